@@ -7,6 +7,7 @@ from fastapi import (
     UploadFile,
     File,
     Security,
+    Query,
     BackgroundTasks
 )
 from db import (
@@ -19,26 +20,37 @@ from db import (
     get_current_user,
     User,
     UserLog,
-    CodeVerification as CVN,
     UserProfile,
     AuthHandler,
     get_db,
     get_session, 
-    redis_client
+    token_denylist,
+    token_cache,
+    verification_codes,
+    PASSWORD_RESET,
+    VERIFY_VALID,
+    VERIFY_EXPIRED,
+    VERIFY_LOCKED,
+    Principal,
+    get_fresh_principal,
+    constraint_name,
 )
-from utils.mail_service.mail_service import EmailSchema, send_email_async
+from utils.mail_service.mail_service import EmailSchema, send_email_async, send_email_background
 from fastapi.responses import Response, JSONResponse
-from fastapi_limiter.depends import RateLimiter as RL
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from fastapi_jwt_auth import AuthJWT
-from utils import CBV, GeoIpLocation
-from typing import Dict, Any
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from utils import CBV
+from utils.audit_log import login_audit
+from utils.rate_limit import RateLimit
+from core.authentication_api import user_import
+from typing import Dict, Any, Optional
 from settings import LOGGER
-from PIL import Image
-import os
-import datetime
-import random
+from core.uploader.image_pipeline import image_pipeline
+from core.uploader.media_store import content_store
 import secrets
 
 auth_router = APIRouter(
@@ -47,6 +59,12 @@ auth_router = APIRouter(
 )
 wrapper_auth = CBV(auth_router)
 
+SIGNUP_CONFLICTS = {
+    "user_email_key": "User with the email already exists",
+    "user_username_key": "User with the username already exists",
+    "user_phone_number_key": "phone number already exists",
+}
+
 
 @auth_router.get('/')
 async def hello(Authorize: str = Depends(AuthHandler.Token_requirement)) -> dict:
@@ -77,8 +95,7 @@ async def signUp(user: SignUpModel, response: Response, db: get_session = Depend
         response (Response): custom response
 
     Raises:
-        HTTPException: existing email on 1st raise
-        HTTPException: existing username on 2nd raise
+        HTTPException: existing email, username or phone number
     Requests:
         dict:
         {
@@ -97,68 +114,67 @@ async def signUp(user: SignUpModel, response: Response, db: get_session = Depend
             "is_active": boolean
         }
     """
-    db_email = db.query(User).filter(User.email == user.email).first()
-    db_username = db.query(User).filter(
-        User.username == user.username).first()
-    db_phone_number = db.query(User).filter(
-        User.phone_number == user.phone_number).first()
-    if db_email is not None:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        LOGGER.error(f'signup email exists')
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="User with the email already exists",
-                            headers=None
-                            )
-    if db_username is not None:
-        LOGGER.error(f'signup username exists')
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="User with the username already exists",
-                            headers=None
-                            )
-    if db_phone_number is not None:
-        LOGGER.error(f'signup phone number exists')
+    user_dict = {
+        "username": user.username,
+        "email": user.email,
+        "phone_number": user.phone_number,
+        "password": await user.hashed_password(),
+        "is_active": True if user.phone_number is not None else False,
+        "is_staff": False
+    }
+    # one round trip, the unique constraints decide instead of three SELECTs
+    try:
+        await db.execute(insert(User).values(**user_dict))
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        detail = SIGNUP_CONFLICTS.get(constraint_name(e), "user creation failed")
+        LOGGER.error(f'signup {detail}')
         response.status_code = status.HTTP_400_BAD_REQUEST
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="phone number already exists",
+                            detail=detail,
                             headers=None
                             )
-    try:
-        user_dict = {
-            "username": user.username,
-            "email": user.email,
-            "phone_number": user.phone_number,
-            "password": user.hashed_password(),
-            "is_active": True if user.phone_number is not None else False,
-            "is_staff": False
-        }
-        new_user = User(**user_dict)
-        user.password2 = user.hashed_password()
-        db.add(new_user)
-        db.commit()
-        resp = {
-            "status": "success",
-            "message": "User created successfully",
-        }
-        return JSONResponse(content=resp, status_code=status.HTTP_201_CREATED)
-    except Exception as e:
-        LOGGER.error(f'signup user creation failed')
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="user creation failed"
-        )
+    resp = {
+        "status": "success",
+        "message": "User created successfully",
+    }
+    return JSONResponse(content=resp, status_code=status.HTTP_201_CREATED)
+
+
+@auth_router.post('/users/import')
+async def import_users(
+        file: UploadFile = File(...),
+        fmt: Optional[str] = Query(None, regex="^(csv|ndjson)$"),
+        principal: Principal = Security(get_fresh_principal),
+        db: get_session = Depends(get_db)) -> dict:
+    """bulk user import from a CSV (with header) or NDJSON upload (staff only)
+
+    Rows are validated like signup, passwords hashed on a dedicated process
+    pool and the users loaded with COPY, existing users are skipped.
+
+    Args:
+        file (UploadFile): csv or ndjson file, the format follows the file suffix unless fmt is given
+        fmt (str, optional): csv or ndjson
+
+    Raises:
+        HTTPException: 403 for non staff users
+
+    Returns:
+        dict: received, created, skipped and invalid counts with the first validation errors
+    """
+    if not principal.is_staff:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Must be staff")
+    if fmt is None:
+        fmt = "ndjson" if (file.filename or "").endswith((".ndjson", ".jsonl")) else "csv"
+    return await user_import.import_users(db, user_import.upload_lines(file), fmt)
 
 
 # login route
-# @auth_router.post('/login',dependencies=[Depends(RL(times=2, seconds=5))]) # ratelimiter from fastapi-limiter
 @auth_router.post('/login')
-# @limiter.limit("2/minute")
 async def login(request: Request, user: LoginModel, Authorize: AuthJWT = Depends(),
-                # query with async
-                # db: Asyncget_session = Depends(get_db)
-                # none async query
-                db: get_session = Depends(get_db)
-                ) -> JSONResponse:
+                db: get_session = Depends(get_db)) -> JSONResponse:
     """user login
 
     Args:
@@ -184,13 +200,14 @@ async def login(request: Request, user: LoginModel, Authorize: AuthJWT = Depends
         }
 
     """
-    # normal query
-    db_user = db.query(User).filter(User.username == user.username).first()
-    # async query
-    # db_user = (await db.execute(select(User).where(
-    #     User.username == user.username))).scalars().first()
+    db_user = (await db.execute(select(User).where(
+        User.username == user.username))).scalars().first()
     ip_loc = request.client.host
-    if db_user and AuthHandler.verify_password(db_user.password, user.password):
+    if db_user and await AuthHandler.verify_password(db_user.password, user.password):
+        if AuthHandler.needs_rehash(db_user.password):
+            # stored with outdated parameters, upgrade while we have the plain password
+            db_user.password = await AuthHandler.get_password_hash(user.password)
+            await db.commit()
         user_claims = {
             db_user.username: {
                 "id": db_user.id,
@@ -198,31 +215,14 @@ async def login(request: Request, user: LoginModel, Authorize: AuthJWT = Depends
                 "phone_number": db_user.phone_number,
                 "is_active": db_user.is_active,
                 "is_staff": db_user.is_staff,
-            }
+            },
+            "gen": await token_denylist.generation(db_user.id),
         }
         access_token = Authorize.create_access_token(
             subject=user.username, user_claims=user_claims, algorithm='HS256')
         refresh_token = Authorize.create_refresh_token(
             subject=user.username, user_claims=user_claims, algorithm='HS256')
-        geo = await GeoIpLocation(ip_loc)
-        if geo['status'] != "fail":
-            # none async query
-            geoLoc = UserLog(user_id=db_user.id, user_log=geo)
-            db.add(geoLoc)
-            db.commit()
-            # async query
-            # geoLoc = UserLog(user_id=db_user.id, user_log={"query": ip_loc})
-            # db.add(geoLoc)
-            # await db.commit()
-        else:
-            # none async query
-            geoLoc = UserLog(user_id=db_user.id, user_log=geo)
-            db.add(geoLoc)
-            db.commit()
-            # async query
-            # geoLoc = UserLog(user_id=db_user.id, user_log={"query": ip_loc})
-            # db.add(geoLoc)
-            # await db.commit()
+        login_audit.record(db_user.id, ip_loc)
         resp = {
             "access_token": access_token,
             "refresh_token": refresh_token
@@ -256,7 +256,7 @@ async def refresh_token(Authorize: str = Depends(AuthHandler.Refresh_token_requi
         }
     """
     current_user = Authorize.get_jwt_subject()
-    db_user = db.query(User).filter(User.username == current_user).first()
+    db_user = (await db.execute(select(User).where(User.username == current_user))).scalars().first()
     if db_user.is_active:
         user_claims = {
             db_user.username: {
@@ -265,7 +265,8 @@ async def refresh_token(Authorize: str = Depends(AuthHandler.Refresh_token_requi
                 "phone_number": db_user.phone_number,
                 "is_active": db_user.is_active,
                 "is_staff": db_user.is_staff,
-            }
+            },
+            "gen": await token_denylist.generation(db_user.id),
         }
         access_token = Authorize.create_access_token(
             subject=current_user, user_claims=user_claims, algorithm='HS256')
@@ -287,7 +288,7 @@ def access_revoke(Authorize: str = Depends(AuthHandler.Token_requirement)) -> di
     Authorize.jwt_required()
 
     jti = Authorize.get_raw_jwt()['jti']
-    redis_client.setex(jti, Settings().access_expires, 'true')
+    token_denylist.revoke(jti, Settings().access_expires)
     LOGGER.info(f'{jti}-access-Revoked')
     return {"detail": "Access token has been revoke"}
 
@@ -297,26 +298,31 @@ def refresh_revoke(Authorize: str = Depends(AuthHandler.Refresh_token_requiremen
     Authorize.jwt_refresh_token_required()
 
     jti = Authorize.get_raw_jwt()['jti']
-    redis_client.setex(jti, Settings().refresh_expires, 'true')
+    token_denylist.revoke(jti, Settings().refresh_expires)
     LOGGER.info(f'{jti}-refresh-Revoked')
     return {"detail": "Refresh token has been revoke"}
 
 
+@auth_router.get('/token-cache')
+async def token_cache_stats(current_user: User = Security(get_current_user)) -> dict:
+    """hit/miss counters of this worker's verified token cache and denylist lookups (staff only)"""
+    if not current_user['is_staff']:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Must be staff")
+    return {**token_cache.stats(), "denylist": token_denylist.stats()}
+
+
 # user change and reset password
-@wrapper_auth('/password', dependencies=[Depends(RL(times=2, minutes=3))])
-# @limiter.limit("5/minute")   # not working on websocket yet
+@wrapper_auth('/password', dependencies=[Depends(RateLimit(times=2, minutes=3))])
 class ResetPassword:
     async def get(query: GetCodeSchema = Depends(), db: get_session = Depends(get_db)) -> JSONResponse:
-        CVN.old_code_remover(db)
-        db_user = db.query(User).filter(
-            User.username == query.username).first()
+        db_user = (await db.execute(select(User).where(
+            User.username == query.username))).scalars().first()
         if db_user:
             if db_user.is_active:
-                random_code = random.randint(1000, 9999)
+                random_code = 1000 + secrets.randbelow(9000)
                 if query.plan == 'email':
-                    code = CVN(user_id=db_user.id, code=str(random_code))
-                    db.add(code)
-                    db.commit()
+                    await verification_codes.issue(db_user.id, PASSWORD_RESET, str(random_code))
                     response = {
                         "status": "success",
                         "message": "verify code already send"
@@ -332,9 +338,7 @@ class ResetPassword:
                     LOGGER.info(f'reset password code receiver - email sent')
                     return JSONResponse(status_code=200, content={"message": "email has been sent"})
                 elif query.plan == 'mobile':
-                    code = CVN(user_id=db_user.id, code=str(random_code))
-                    db.add(code)
-                    db.commit()
+                    await verification_codes.issue(db_user.id, PASSWORD_RESET, str(random_code))
                     LOGGER.info(f'reset password code receiver - sms sent')
                     return JSONResponse(status_code=200, content={"message": "sms has been sent"})
                 else:
@@ -353,38 +357,34 @@ class ResetPassword:
             )
 
     async def post(request: ResetPassword, db: get_session = Depends(get_db)) -> JSONResponse:
-        db_user = db.query(User).filter(
-            User.username == request.username).first()
-        verify_code = db.query(CVN).filter(
-            User.username == request.username).order_by(CVN.id.desc()).first()
+        db_user = (await db.execute(select(User).where(
+            User.username == request.username))).scalars().first()
         if db_user:
             if db_user.is_active:
-                if db_user.id == verify_code.user_id:
-                    if verify_code.validation and verify_code.expiration_time < (
-                            datetime.datetime.now() + datetime.timedelta(minutes=5)):
-                        if verify_code.code == request.code:
-                            db_user.password = request.hashed_password()
-                            verify_code.validation = False
-                            db.commit()
-                            resp = {
-                                "status": "success",
-                                "message": "Password changed successfully"
-                            }
-                            return JSONResponse(content=resp, status_code=status.HTTP_201_CREATED)
-                        else:
-                            raise HTTPException(
-                                status_code=status.HTTP_400_BAD_REQUEST,
-                                detail="verification code is not valid"
-                            )
-                    else:
-                        raise HTTPException(
-                            status_code=status.HTTP_403_FORBIDDEN,
-                            detail="verification code expired"
-                        )
-                else:
+                result = await verification_codes.verify(db_user.id, PASSWORD_RESET, request.code)
+                if result == VERIFY_VALID:
+                    db_user.password = await request.hashed_password()
+                    await db.commit()
+                    await token_denylist.bump_generation(db_user.id)
+                    resp = {
+                        "status": "success",
+                        "message": "Password changed successfully"
+                    }
+                    return JSONResponse(content=resp, status_code=status.HTTP_201_CREATED)
+                elif result == VERIFY_EXPIRED:
                     raise HTTPException(
                         status_code=status.HTTP_403_FORBIDDEN,
-                        detail="invalid username"
+                        detail="verification code expired"
+                    )
+                elif result == VERIFY_LOCKED:
+                    raise HTTPException(
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        detail="too many attempts, request a new code"
+                    )
+                else:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="verification code is not valid"
                     )
             else:
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
@@ -396,16 +396,16 @@ class ResetPassword:
             )
 
     async def patch(request: Dict = Body(...), db: get_session = Depends(get_db)) -> JSONResponse:
-        db_user = db.query(User).filter(
-            User.username == request['username']).first()
+        db_user = (await db.execute(select(User).where(
+            User.username == request['username']))).scalars().first()
         if db_user:
             if db_user.is_active:
-                if AuthHandler.verify_password(db_user.password, request['password']):
-                    new_password = AuthHandler.get_password_hash(
-                        request['new_password'])
-                    if not AuthHandler.verify_password(db_user.password, request['new_password']):
-                        db_user.password = new_password
-                        db.commit()
+                if await AuthHandler.verify_password(db_user.password, request['password']):
+                    if not await AuthHandler.verify_password(db_user.password, request['new_password']):
+                        db_user.password = await AuthHandler.get_password_hash(
+                            request['new_password'])
+                        await db.commit()
+                        await token_denylist.bump_generation(db_user.id)
                         response = {
                             "status": "success",
                             "message": f"{db_user.username} password changed"
@@ -435,9 +435,25 @@ class ResetPassword:
 
 # user log
 @auth_router.get("/userlog")
-async def user_log(db: get_session = Depends(get_db), current_user: User = Security(get_current_user)) -> jsonable_encoder:
-    db_log = db.query(UserLog).filter(UserLog.user_id ==
-                                      current_user['id']).order_by(UserLog.id.desc()).all()[:10]
+async def user_log(response: Response, limit: int = Query(10, ge=1, le=100), before: Optional[int] = None,
+                   db: get_session = Depends(get_db), current_user: User = Security(get_current_user)) -> jsonable_encoder:
+    """login history of the current user, newest first
+
+    Args:
+        limit (int): page size
+        before (int, optional): only entries older than this log id, taken from the
+            X-Next-Before header of the previous page
+
+    Returns:
+        dict: {login timestamp: geo location}
+    """
+    query = select(UserLog.id, UserLog.login_datetime, UserLog.user_log).where(
+        UserLog.user_id == current_user['id'])
+    if before is not None:
+        query = query.where(UserLog.id < before)
+    db_log = (await db.execute(query.order_by(UserLog.id.desc()).limit(limit))).all()
+    if len(db_log) == limit:
+        response.headers["X-Next-Before"] = str(db_log[-1].id)
     data = {logs.login_datetime.timestamp(): logs.user_log for logs in db_log}
     return jsonable_encoder(data)
 
@@ -449,64 +465,38 @@ class Profile:
     #             with form data
     async def post(profile: UserProfileSchema = Depends(UserProfileSchema.as_form), file: UploadFile = File(...),
                    current_user: User = Security(get_current_user), db: get_session = Depends(get_db)) -> jsonable_encoder:
-        db_user = db.query(User).filter(
-            User.id == current_user['id']).first()
-        db_profile = db.query(UserProfile).filter(
-            UserProfile.user_id == db_user.id).first()
+        db_user = (await db.execute(select(User).where(
+            User.id == current_user['id']))).scalars().first()
+        db_profile = (await db.execute(select(UserProfile).where(
+            UserProfile.user_id == db_user.id))).scalars().first()
         if not db_profile:
-            file_content = await file.read()
-            generated_name = ""
-            FILEPATH = "media/profile_image/"
-            extension = file.filename.split(".")[1]
-            token_name = secrets.token_hex(10) + "." + extension
-            if not os.path.exists(FILEPATH + f'{db_user.id}'):
-                make_user_dir: str = os.mkdir(FILEPATH + f'{db_user.id}')
-                generated_name += make_user_dir + "/" + token_name
-            else:
-                generated_name += FILEPATH + f'{db_user.id}/' + token_name
-            if extension not in ["jpg", "png"]:
-                raise HTTPException(
-                    status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                    detail="file extension is not valid"
+            profile.image, renditions = await image_pipeline.profile_image(file)
+            try:
+                user_profile = UserProfile(
+                    user_id=db_user.id,
+                    first_name=profile.first_name,
+                    last_name=profile.last_name,
+                    address=profile.address,
+                    image=profile.image,
+                    image_digest=content_store.digest_of(profile.image),
+                    postal_code=profile.postal_code,
+                    national_code=profile.national_code,
                 )
-            if not os.path.exists(generated_name):
-                with open(generated_name, "wb") as file_object:
-                    file_object.write(file_content)
-                img = Image.open(generated_name)
-                img = img.resize(size=(200, 200))
-                img.save(generated_name)
-                file_object.close()
-                try:
-                    url = str(generated_name)
-                    profile.image = url
-                    user_profile = UserProfile(
-                        user_id=db_user.id,
-                        first_name=profile.first_name,
-                        last_name=profile.last_name,
-                        address=profile.address,
-                        image=profile.image,
-                        postal_code=profile.postal_code,
-                        national_code=profile.national_code,
-                    )
-                    db.add(user_profile)
-                    db.commit()
-                    response = {
-                        "user": db_user.username,
-                        "first_name": profile.first_name,
-                        "last_name": profile.last_name,
-                        "address": profile.address,
-                        "image": profile.image
-                    }
-                    return jsonable_encoder(response)
-                except Exception as e:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="User profile already exists"
-                    )
-            else:
+                db.add(user_profile)
+                await db.commit()
+                response = {
+                    "user": db_user.username,
+                    "first_name": profile.first_name,
+                    "last_name": profile.last_name,
+                    "address": profile.address,
+                    "image": profile.image,
+                    "renditions": renditions
+                }
+                return jsonable_encoder(response)
+            except Exception as e:
                 raise HTTPException(
-                    status_code=404,
-                    detail="file already exists"
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="User profile already exists"
                 )
         else:
             raise HTTPException(
@@ -515,8 +505,8 @@ class Profile:
             )
 
     async def get(current_user: User = Security(get_current_user), db: get_session = Depends(get_db)) -> jsonable_encoder:
-        db_profile = db.query(UserProfile).filter(
-            UserProfile.user_id == current_user['id']).first()
+        db_profile = (await db.execute(select(UserProfile).options(joinedload(UserProfile.user)).where(
+            UserProfile.user_id == current_user['id']))).scalars().first()
         if db_profile:
             return jsonable_encoder(
                 {
@@ -535,52 +525,35 @@ class Profile:
 
     async def patch(profile: UserProfileSchema = Depends(UserProfileSchema.as_form), current_user: User = Security(get_current_user),
                     db: get_session = Depends(get_db), file: UploadFile = File(...)) -> jsonable_encoder:
-        db_profile = db.query(UserProfile).filter(
-            UserProfile.user_id == current_user['id']).first()
+        db_profile = (await db.execute(select(UserProfile).options(joinedload(UserProfile.user)).where(
+            UserProfile.user_id == current_user['id']))).scalars().first()
         if db_profile:
-            file_content = await file.read()
-            generated_name = ""
-            FILEPATH = "media/profile_image/"
-            extension = file.filename.split(".")[1]
-            token_name = secrets.token_hex(10) + "." + extension
-            if not os.path.exists(FILEPATH + f'{current_user["id"]}'):
-                make_user_dir: str = os.mkdir(
-                    FILEPATH + f'{current_user["id"]}')
-                generated_name += make_user_dir + "/" + token_name
-            else:
-                generated_name += FILEPATH + \
-                    f'{current_user["id"]}/' + token_name
-            if extension not in ["jpg", "png"]:
-                raise HTTPException(
-                    status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                    detail="file extension is not valid"
-                )
-            if not os.path.exists(generated_name):
-                with open(generated_name, "wb") as file_object:
-                    file_object.write(file_content)
-                img = Image.open(generated_name)
-                img = img.resize(size=(200, 200))
-                img.save(generated_name)
-                file_object.close()
+            profile.image, _ = await image_pipeline.profile_image(file)
+            previous_image = db_profile.image
             try:
-                url = str(generated_name)
-                profile.image = url
                 db_profile.first_name = profile.first_name
                 db_profile.last_name = profile.last_name
                 db_profile.address = profile.address
                 db_profile.image = profile.image
+                db_profile.image_digest = content_store.digest_of(profile.image)
                 db_profile.national_code = profile.national_code
                 db_profile.postal_code = profile.postal_code
-                db.commit()
-                return jsonable_encoder({
-                    "status": "success",
-                    "message": f"{db_profile.user.username}'s profile updated"
-                })
+                await db.commit()
             except Exception:
                 raise HTTPException(
                     status_code=status.HTTP_204_NO_CONTENT,
                     detail="Fill all requirements"
                 )
+            # the update is committed, a blob left behind is swept by the media gc
+            if str(previous_image) != profile.image:
+                try:
+                    await content_store.release(db, str(previous_image))
+                except Exception as e:
+                    LOGGER.error(f'profile image release failed: {e}')
+            return jsonable_encoder({
+                "status": "success",
+                "message": f"{db_profile.user.username}'s profile updated"
+            })
         else:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -605,4 +578,10 @@ async def send_in_background(
         background_tasks: BackgroundTasks,
         email: EmailSchema
 ) -> JSONResponse:
+    send_email_background(
+        background_tasks,
+        subject=email.dict().get("subject"),
+        email_to=email.dict().get("email"),
+        body=email.dict().get("body")
+    )
     return JSONResponse(status_code=200, content={"message": "email has been sent"})
@@ -0,0 +1,160 @@
+from typing import AsyncIterator, Iterator, List
+from collections import deque
+from pydantic import ValidationError
+from sqlalchemy import text
+from decouple import config
+from db import User, SignUpModel, password_hasher, copy_records
+from settings import LOGGER
+import json
+import csv
+
+IMPORT_BATCH_SIZE = config('IMPORT_BATCH_SIZE', default=1000, cast=int)
+IMPORT_HASH_PROCESSES = config('IMPORT_HASH_PROCESSES', default=None, cast=lambda v: int(v) if v else None)
+IMPORT_MAX_ERRORS = 100
+CSV_COLUMNS = ("username", "email", "password", "phone_number")
+STAGING_COLUMNS = ("username", "email", "phone_number", "password", "is_active")
+
+
+async def upload_lines(file, chunk_size: int = 64 * 1024) -> AsyncIterator[str]:
+    """iterate an UploadFile line by line without reading it into memory"""
+    pending = b""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+def _feed(pending: deque) -> Iterator[str]:
+    """endless line source of the csv reader, only read once a record is complete"""
+    while True:
+        yield pending.popleft() if pending else ""
+
+
+async def parse_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[dict]:
+    """rows of the upload, None for blank lines, headers and continuation lines
+
+    One yield per physical line keeps the caller's line numbers right; a CSV
+    record spanning lines (a quoted field with a newline) is yielded on its
+    first line.
+    """
+    header = None
+    # one csv.reader for the whole upload, lines are handed over once a record is complete
+    pending = deque()
+    reader = csv.reader(_feed(pending))
+    record_lines = 0
+    quotes = 0
+    async for line in lines:
+        if fmt == "ndjson":
+            if not line.strip():
+                yield None
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = e  # reported as an invalid row, the import goes on
+            yield row if isinstance(row, (dict, Exception)) else ValueError("row must be a JSON object")
+            continue
+        if not record_lines and not line.strip():
+            yield None
+            continue
+        pending.append(line + "\n")
+        record_lines += 1
+        quotes += line.count('"')
+        if quotes % 2:
+            # inside a quoted field, the record goes on on the next line
+            continue
+        values = next(reader)
+        lines_read, record_lines, quotes = record_lines, 0, 0
+        if header is None:
+            header = values if set(values) & set(CSV_COLUMNS) else list(CSV_COLUMNS)
+            if header is values:
+                for _ in range(lines_read):
+                    yield None
+                continue
+        yield dict(zip(header, values))
+        for _ in range(lines_read - 1):
+            yield None
+    if record_lines:
+        yield ValueError("unterminated quoted field")
+
+
+def validated_user(row: dict) -> SignUpModel:
+    """SignUpModel of a row, also checking the column lengths
+
+    An overlong value would make COPY fail the whole batch.
+    """
+    user = SignUpModel(**{key: value for key, value in row.items() if value not in ("", None)})
+    for name in ("username", "email", "phone_number"):
+        value, limit = getattr(user, name), User.__table__.c[name].type.length
+        if value is not None and len(value) > limit:
+            raise ValueError(f"{name} longer than {limit} characters")
+    return user
+
+
+async def _insert_batch(db, batch: List[SignUpModel], executor) -> int:
+    hashes = await password_hasher.hash_many([user.password for user in batch], executor)
+    records = [
+        (user.username, user.email, user.phone_number, password, user.phone_number is not None)
+        for user, password in zip(batch, hashes)
+    ]
+    # staging table lives for this transaction only, rows clashing with any
+    # unique constraint (or with each other) are skipped by ON CONFLICT
+    await db.execute(text(
+        'CREATE TEMP TABLE user_import (LIKE "user" INCLUDING DEFAULTS) ON COMMIT DROP'))
+    await copy_records(db, "user_import", STAGING_COLUMNS, records)
+    inserted = await db.execute(text(
+        'INSERT INTO "user" (username, email, phone_number, password, is_active, is_staff) '
+        'SELECT username, email, phone_number, password, is_active, false FROM user_import '
+        'ON CONFLICT DO NOTHING RETURNING id'))
+    count = len(inserted.all())
+    await db.commit()
+    return count
+
+
+async def import_users(db, lines: AsyncIterator[str], fmt: str) -> dict:
+    """validate, hash and COPY users in batches of IMPORT_BATCH_SIZE, committing each batch
+
+    Returns:
+        dict: counts of received, created, skipped (already existing) and invalid rows
+            plus the first IMPORT_MAX_ERRORS validation errors by line number
+    """
+    received = created = invalid = 0
+    errors, batch = [], []
+    executor = password_hasher.bulk_executor(IMPORT_HASH_PROCESSES)
+    try:
+        line_number = 0
+        async for row in parse_rows(lines, fmt):
+            line_number += 1
+            if row is None:
+                continue
+            received += 1
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append(validated_user(row))
+            except (ValidationError, ValueError, TypeError) as e:
+                invalid += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                created += await _insert_batch(db, batch, executor)
+                batch = []
+        if batch:
+            created += await _insert_batch(db, batch, executor)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    LOGGER.info(f'user import: {received} received, {created} created, {invalid} invalid')
+    return {
+        "received": received,
+        "created": created,
+        "skipped": received - created - invalid,
+        "invalid": invalid,
+        "errors": errors,
+    }
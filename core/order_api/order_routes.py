@@ -1,21 +1,36 @@
-from typing import Any
-from fastapi import APIRouter, status, Depends, Security
+from typing import Any, Optional
+from fastapi import APIRouter, status, Depends, Security, Query, Header
 from fastapi import Body
 from fastapi.encoders import jsonable_encoder
 from db import (
     AuthHandler,
     Order,
-    User,
     get_db,
-    Session,
+    AsyncSession,
     OrderModel,
     OrderStatusModel,
     OrderTest,
-    get_current_user,
+    OrderIdsModel,
+    Principal,
+    get_current_principal,
+    get_fresh_principal,
+    estimate_rows,
+    session_scope,
+    stream_rows,
+    copy_csv,
 )
 from fastapi.exceptions import HTTPException
-from fastapi.responses import Response
-from utils.celery.celery_worker import create_task
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import select, insert, update, delete, values, column, cast, literal, func, any_, bindparam, Integer, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from pydantic import conlist
+from db.schema.order_schema import BULK_MAX_ITEMS
+from decouple import config
+import binascii
+import base64
+import json
+import csv
+import io
 
 
 order_router = APIRouter(
@@ -23,10 +38,123 @@ order_router = APIRouter(
     dependencies=[Depends(AuthHandler.Token_requirement)],
     tags=['Orders']
 )
+ORDER_STATUS_PATTERN = f"^({'|'.join(code for code, _ in Order.ORDER_STATUSES)})$"
+ORDER_SIZE_PATTERN = f"^({'|'.join(code for code, _ in Order.ORDER_SIZES)})$"
+ORDER_SIZE_CODES = {code for code, _ in Order.ORDER_SIZES}
+EXPORT_YIELD_PER = config('EXPORT_YIELD_PER', default=1000, cast=int)
+EXPORT_COLUMNS = (Order.id, Order.user_id, Order.order_status, Order.order_sizes, Order.quantity)
+ORDER_RETURNING = (Order.id, Order.quantity, Order.order_sizes, Order.order_status, Order.version_id)
+
+
+def encode_cursor(order_id: int) -> str:
+    return base64.urlsafe_b64encode(str(order_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Raises:
+        HTTPException: 400 for a token that was not produced by encode_cursor
+    """
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def filter_orders(query, order_status: Optional[str] = None, order_sizes: Optional[str] = None,
+                  user_id: Optional[int] = None):
+    if order_status is not None:
+        query = query.where(Order.order_status == order_status)
+    if order_sizes is not None:
+        query = query.where(Order.order_sizes == order_sizes)
+    if user_id is not None:
+        query = query.where(Order.user_id == user_id)
+    return query
+
+
+def owned_by(statement, principal: Principal):
+    """scope a select/update/delete on orders to the orders of ``principal``
+
+    ``WHERE id = :id AND user_id = :uid`` is answered from the primary key (or
+    ix_orders_user_id_id) and needs no separate ownership query. Staff act on
+    every order.
+    """
+    if principal.is_staff:
+        return statement
+    return statement.where(Order.user_id == principal.id)
+
+
+def order_etag(version_id: int) -> str:
+    return f'"{version_id}"'
+
+
+def if_match_version(if_match: Optional[str]) -> Optional[int]:
+    """order version required by an If-Match header, None without a header or for ``*``
+
+    Raises:
+        HTTPException: 412 for a tag that is not an order version
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="If-Match does not match the order"
+        )
+
+
+async def write_failure(db: AsyncSession, id: int, version: Optional[int],
+                        principal: Principal) -> Optional[HTTPException]:
+    """why a conditional UPDATE/DELETE matched no row
+
+    Only runs on the failure path. Returns 404 for a missing order (or one of
+    another user) and 412 for a stale If-Match, None when the row exists but
+    failed the route's own condition.
+    """
+    current = (await db.execute(owned_by(select(Order.version_id).where(Order.id == id), principal))).scalar()
+    if current is None:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found"
+        )
+    if version is not None and current != version:
+        return HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Order has been modified, fetch it again"
+        )
+    return None
+
+
+async def order_page(db: AsyncSession, query, limit: int, cursor: Optional[str], with_total: bool) -> dict:
+    """one page of ``query``, newest first
+
+    Keyset pagination on the (user_id, id) / (order_status, id) indexes: the
+    cursor is the last id of the previous page, so every page costs the same
+    however deep the client scrolls. One row more than ``limit`` is read to
+    know whether there is a next page.
+    """
+    total = await estimate_rows(db, query) if with_total else None
+    if cursor is not None:
+        query = query.where(Order.id < decode_cursor(cursor))
+    orders = (await db.execute(query.order_by(Order.id.desc()).limit(limit + 1))).scalars().all()
+    next_cursor = encode_cursor(orders[limit - 1].id) if len(orders) > limit else None
+    return {
+        "orders": jsonable_encoder(orders[:limit]),
+        "next_cursor": next_cursor,
+        "approximate_total": total,
+    }
 
 
 @order_router.post('/test')
 def add_order(order: OrderTest):
+    # importing celery costs more than the rest of the order routes, only pay for it when used
+    from utils.celery.celery_worker import create_task
+
     cy = create_task.delay(order.customer_name, order.order_quantity)
     result = create_task.AsyncResult(cy.task_id)
     # print(result.get())
@@ -52,8 +180,8 @@ async def hello1(request: Any = Body(...)):
 
 
 @order_router.post('/order')
-async def place_an_order(order: OrderModel, response: Response,  current_user: User = Security(get_current_user),
-                         db: Session = Depends(get_db)):
+async def place_an_order(order: OrderModel, response: Response,  principal: Principal = Security(get_current_principal),
+                         db: AsyncSession = Depends(get_db)):
     """place an order
 
     Args:
@@ -84,18 +212,15 @@ async def place_an_order(order: OrderModel, response: Response,  current_user: U
             }
         }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-
-    if user.is_active:
+    if principal.is_active:
         new_order = Order(
             order_sizes=order.order_sizes,
             quantity=order.quantity,
+            user_id=principal.id,
         )
 
-        new_order.user = user
-
         db.add(new_order)
-        db.commit()
+        await db.commit()
         response.status_code = status.HTTP_201_CREATED
         resp = {
             "order_size": new_order.order_sizes,
@@ -111,33 +236,220 @@ async def place_an_order(order: OrderModel, response: Response,  current_user: U
         )
 
 
+def bulk_item_error(order: OrderModel) -> Optional[str]:
+    if order.quantity < 1:
+        return "quantity must be positive"
+    if order.order_sizes is not None and order.order_sizes not in ORDER_SIZE_CODES:
+        return f"unknown size {order.order_sizes}"
+    return None
+
+
+def bulk_status(results: list, success: int) -> int:
+    """``success`` when every item went through, 207 Multi-Status otherwise"""
+    return success if all(result["status"] == success for result in results) else status.HTTP_207_MULTI_STATUS
+
+
+# bulk orders, registered before /{id} so "bulk" is not taken for an order id
+@order_router.post('/bulk')
+async def bulk_place_orders(orders: conlist(OrderModel, min_items=1, max_items=BULK_MAX_ITEMS), response: Response,
+                            principal: Principal = Security(get_current_principal),
+                            db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
+    """place up to BULK_MAX_ITEMS orders with a single INSERT ... SELECT FROM (VALUES ...) RETURNING
+
+    Invalid items are reported and skipped, the valid ones are inserted in one
+    transaction.
+
+    Raises:
+        HTTPException: user activation
+
+    Returns:
+        list: one result per submitted order, in request order
+        [
+            {"index": int, "status": 201, "id": int}
+            | {"index": int, "status": 422, "detail": string}
+        ]
+    """
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User is not active"
+        )
+    results, rows = [], []
+    for index, order in enumerate(orders):
+        error = bulk_item_error(order)
+        if error:
+            results.append({"index": index, "status": status.HTTP_422_UNPROCESSABLE_ENTITY, "detail": error})
+        else:
+            rows.append((index, order))
+    if rows:
+        new = values(
+            column("ordinal", Integer), column("quantity", Integer), column("order_sizes", String), name="new"
+        ).data([
+            # parameters inside VALUES are untyped for postgres, asyncpg needs the casts
+            (cast(literal(index), Integer), cast(literal(order.quantity), Integer),
+             cast(literal(order.order_sizes or "SMALL"), String))
+            for index, order in rows
+        ])
+        # RETURNING order is not guaranteed: draw the ids first, so each one is tied to its input ordinal
+        numbered = select(
+            new, func.nextval(func.pg_get_serial_sequence(Order.__tablename__, "id")).label("id")
+        ).cte("numbered")
+        inserted = insert(Order).from_select(
+            ["id", "quantity", "order_status", "order_sizes", "user_id"],
+            select(numbered.c.id, numbered.c.quantity, cast(literal("PENDING"), String),
+                   numbered.c.order_sizes, cast(literal(principal.id), Integer))
+        ).returning(Order.id).cte("inserted")
+        created = (await db.execute(
+            select(numbered.c.ordinal, inserted.c.id).join_from(inserted, numbered, inserted.c.id == numbered.c.id)
+        )).all()
+        await db.commit()
+        results += [{"index": index, "status": status.HTTP_201_CREATED, "id": order_id}
+                    for index, order_id in created]
+    results.sort(key=lambda result: result["index"])
+    response.status_code = bulk_status(results, status.HTTP_201_CREATED)
+    return results
+
+
+@order_router.patch('/bulk')
+async def bulk_update_orders(orders: conlist(OrderModel, min_items=1, max_items=BULK_MAX_ITEMS), response: Response,
+                             principal: Principal = Security(get_current_principal),
+                             db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
+    """update quantity and size of PENDING orders with one UPDATE ... FROM (VALUES ...)
+
+    Orders of other users can only be changed by staff. An omitted size keeps
+    the current one.
+
+    Raises:
+        HTTPException: user activation
+
+    Returns:
+        list: one result per submitted order, in request order
+        [
+            {"index": int, "status": 200, "id": int}
+            | {"index": int, "status": 404 | 422, "id": int, "detail": string}
+        ]
+    """
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User is not active"
+        )
+    results, rows, seen = [], [], set()
+    for index, order in enumerate(orders):
+        if order.id is None:
+            error = "id is required"
+        elif order.id in seen:
+            error = "duplicate id"
+        else:
+            error = bulk_item_error(order)
+        if error:
+            results.append({"index": index, "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            "id": order.id, "detail": error})
+        else:
+            seen.add(order.id)
+            rows.append((index, order))
+    if rows:
+        changes = values(
+            column("id", Integer), column("quantity", Integer), column("order_sizes", String), name="changes"
+        ).data([
+            # parameters inside VALUES are untyped for postgres, asyncpg needs the casts
+            (cast(literal(order.id), Integer), cast(literal(order.quantity), Integer),
+             cast(literal(order.order_sizes), String))
+            for _, order in rows
+        ])
+        statement = owned_by(
+            update(Order)
+            .where(Order.id == changes.c.id, Order.order_status == "PENDING")
+            .values(quantity=changes.c.quantity,
+                    order_sizes=func.coalesce(changes.c.order_sizes, Order.order_sizes),
+                    version_id=Order.version_id + 1)
+            .returning(Order.id)
+            .execution_options(synchronize_session=False),
+            principal
+        )
+        updated = set((await db.execute(statement)).scalars().all())
+        await db.commit()
+        for index, order in rows:
+            if order.id in updated:
+                results.append({"index": index, "status": status.HTTP_200_OK, "id": order.id})
+            else:
+                results.append({"index": index, "status": status.HTTP_404_NOT_FOUND, "id": order.id,
+                                "detail": "order not found or no longer pending"})
+    results.sort(key=lambda result: result["index"])
+    response.status_code = bulk_status(results, status.HTTP_200_OK)
+    return results
+
+
+@order_router.delete('/bulk')
+async def bulk_delete_orders(orders: OrderIdsModel, response: Response,
+                             principal: Principal = Security(get_current_principal),
+                             db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
+    """delete orders with one DELETE ... WHERE id = ANY(:ids) RETURNING id
+
+    Orders of other users can only be deleted by staff.
+
+    Raises:
+        HTTPException: user activation
+
+    Returns:
+        list: one result per submitted id
+        [{"id": int, "status": 200 | 404}]
+    """
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User is not active"
+        )
+    statement = owned_by(
+        delete(Order)
+        .where(Order.id == any_(bindparam("ids", orders.ids, type_=ARRAY(Integer))))
+        .returning(Order.id)
+        .execution_options(synchronize_session=False),
+        principal
+    )
+    deleted = set((await db.execute(statement)).scalars().all())
+    await db.commit()
+    results = [{"id": order_id, "status": status.HTTP_200_OK if order_id in deleted else status.HTTP_404_NOT_FOUND}
+               for order_id in dict.fromkeys(orders.ids)]
+    response.status_code = bulk_status(results, status.HTTP_200_OK)
+    return results
+
+
 # list of orders
 
 
 @order_router.get('/order_list')
-async def list_orders(current_user: User = Security(get_current_user), db: Session = Depends(get_db)):
-    """list of orders
+async def list_orders(limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                      order_status: Optional[str] = Query(None, regex=ORDER_STATUS_PATTERN),
+                      order_sizes: Optional[str] = Query(None, regex=ORDER_SIZE_PATTERN),
+                      user_id: Optional[int] = None, with_total: bool = False,
+                      principal: Principal = Security(get_current_principal), db: AsyncSession = Depends(get_db)):
+    """list of orders, newest first
 
     Args:
-        Authorize (AuthJWT, optional): User based on JWT. Defaults to Depends().
+        limit (int): page size
+        cursor (str, optional): next_cursor of the previous page
+        order_status (str, optional): only orders in this status, e.g. PENDING
+        order_sizes (str, optional): only orders of this size, e.g. LARGE
+        user_id (int, optional): only orders of this user
+        with_total (bool): add the planner's estimate of the matching rows
 
     Raises:
         HTTPException: token validation error
         HTTPException: user type
+        HTTPException: invalid cursor
 
     Returns:
-        list:
-        [
-            dict:
-            {
-                same as place and order
-            }
-        ]
+        dict:
+        {
+            "orders": [same as place and order],
+            "next_cursor": string | null,
+            "approximate_total": int | null
+        }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-    if user.is_active:
-        orders = db.query(Order).all()
-        return jsonable_encoder(orders)
+    if principal.is_active:
+        query = filter_orders(select(Order), order_status, order_sizes, user_id)
+        return await order_page(db, query, limit, cursor, with_total)
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Must be superUser"
@@ -148,7 +460,8 @@ async def list_orders(current_user: User = Security(get_current_user), db: Sessi
 
 
 @order_router.get('/orders/{id}')
-async def get_order_by_id(id: int, current_user: User = Security(get_current_user), db: Session = Depends(get_db)):
+async def get_order_by_id(id: int, response: Response, principal: Principal = Security(get_current_principal),
+                          db: AsyncSession = Depends(get_db)):
     """get order by ID
 
     Args:
@@ -166,15 +479,15 @@ async def get_order_by_id(id: int, current_user: User = Security(get_current_use
             same as place and order
         }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-
-    if user.is_active:
-        order = db.query(Order).filter(Order.id == id).first()
+    if principal.is_active:
+        order = (await db.execute(select(Order).where(Order.id == id))).scalars().first()
+        if order is not None:
+            response.headers["ETag"] = order_etag(order.version_id)
         return jsonable_encoder(order)
 
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
-        detail=f"{user.username} is not superuser"
+        detail=f"{principal.username} is not superuser"
     )
 
 
@@ -182,11 +495,19 @@ async def get_order_by_id(id: int, current_user: User = Security(get_current_use
 
 
 @order_router.get('/user/orders')
-async def list_orders(current_user: User = Security(get_current_user), db: Session = Depends(get_db)):
-    """user order list
+async def list_orders(limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                      order_status: Optional[str] = Query(None, regex=ORDER_STATUS_PATTERN),
+                      order_sizes: Optional[str] = Query(None, regex=ORDER_SIZE_PATTERN),
+                      with_total: bool = False,
+                      principal: Principal = Security(get_current_principal), db: AsyncSession = Depends(get_db)):
+    """order list of the current user, newest first
 
     Args:
-        Authorize (AuthJWT, optional): user based on JWT. Defaults to Depends().
+        limit (int): page size
+        cursor (str, optional): next_cursor of the previous page
+        order_status (str, optional): only orders in this status
+        order_sizes (str, optional): only orders of this size
+        with_total (bool): add the planner's estimate of the matching rows
 
     Raises:
         HTTPException: token validation error
@@ -194,30 +515,27 @@ async def list_orders(current_user: User = Security(get_current_user), db: Sessi
         HTTPException: user activation
 
     Returns:
-        dict| list: {
-            same as place and order
-        }
+        dict: same as /order_list
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-
-    if user.is_active:
-        order = user.orders
-        if not len(order):
+    if principal.is_active:
+        query = filter_orders(select(Order), order_status, order_sizes, principal.id)
+        page = await order_page(db, query, limit, cursor, with_total)
+        if not page["orders"] and cursor is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Order Not Found"
             )
-        else:
-            return jsonable_encoder(order)
+        return page
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail=f"{user.username} is not active"
+        detail=f"{principal.username} is not active"
     )
 
 
 #  get current user specific order
 @order_router.get('/user/order/{id}')
-async def get_user_specific_order(id: int, current_user: User = Security(get_current_user), db: Session = Depends(get_db)) -> jsonable_encoder:
+async def get_user_specific_order(id: int, response: Response, principal: Principal = Security(get_current_principal),
+                                  db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
     """get specific order by ID
 
     Args:
@@ -235,37 +553,40 @@ async def get_user_specific_order(id: int, current_user: User = Security(get_cur
             same as place and order
         }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-    if user.is_active:
-        orders = user.orders
-        # if orders:
-        for obj in orders:
-            if obj.id == id:
-                return jsonable_encoder(obj)
-        else:
+    if principal.is_active:
+        order = (await db.execute(owned_by(select(Order).where(Order.id == id), principal))).scalars().first()
+        if order is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"order number {id} not found"
             )
+        response.headers["ETag"] = order_etag(order.version_id)
+        return jsonable_encoder(order)
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
-        detail=f"{user.username} is not active"
+        detail=f"{principal.username} is not active"
     )
 
 
 # update order
 @order_router.patch('/{id}')
-async def update_order(id: int, order: OrderModel, response: Response,
-                       current_user: User = Security(get_current_user), db: Session = Depends(get_db)) -> jsonable_encoder:
+async def update_order(id: int, order: OrderModel, response: Response, if_match: Optional[str] = Header(None),
+                       principal: Principal = Security(get_current_principal), db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
     """update order
 
+    One conditional ``UPDATE ... WHERE id AND user_id AND order_status = 'PENDING'
+    [AND version_id] RETURNING``, no row is read or locked before the write.
+    Orders of other users are only visible to staff.
+
     Args:
         id (int): order ID
         order (order_schema.OrderModel): Order Schema
-        Authorize (AuthJWT, optional): user based on JWT. Defaults to Depends().
+        if_match (str, optional): ETag of the order as last seen by the client
 
     Raises:
         HTTPException: token validation error
+        HTTPException: order not found
+        HTTPException: 412 order changed since If-Match was taken
         HTTPException: order in Action
     Requests:
         dict:
@@ -279,41 +600,45 @@ async def update_order(id: int, order: OrderModel, response: Response,
             same as place in order
         }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-    if user.is_active or user.is_staff:
-        order_update = db.query(Order).filter(Order.id == id).first()
-        if order_update.order_status == "PENDING":
-            order_update.quantity = order.quantity
-            order_update.order_sizes = order.order_sizes
-            db.commit()
-            resp = {
-                "id": order_update.id,
-                "quantity": order_update.quantity,
-                "order_sizes": order_update.order_sizes,
-                "order_status": order_update.order_status,
-            }
-            response.status_code = status.HTTP_201_CREATED
-            return jsonable_encoder(resp)
-        else:
-            raise HTTPException(
+    if principal.is_active or principal.is_staff:
+        version = if_match_version(if_match)
+        statement = owned_by(
+            update(Order)
+            .where(Order.id == id, Order.order_status == "PENDING")
+            .values(quantity=order.quantity, order_sizes=order.order_sizes, version_id=Order.version_id + 1)
+            .returning(*ORDER_RETURNING)
+            .execution_options(synchronize_session=False),
+            principal
+        )
+        if version is not None:
+            statement = statement.where(Order.version_id == version)
+        order_update = (await db.execute(statement)).first()
+        await db.commit()
+        if order_update is None:
+            raise await write_failure(db, id, version, principal) or HTTPException(
                 status_code=status.HTTP_226_IM_USED,
                 detail="Your Order/s already in action"
             )
+        response.headers["ETag"] = order_etag(order_update.version_id)
+        response.status_code = status.HTTP_201_CREATED
+        return jsonable_encoder(dict(order_update._mapping))
 
 
 # update order status
 @order_router.patch('/status/{id}')
-async def update_order_status(id: int, order: OrderStatusModel, response: Response,
-                              current_user: Security = Depends(get_current_user), db: Session = Depends(get_db)) -> jsonable_encoder:
+async def update_order_status(id: int, order: OrderStatusModel, response: Response, if_match: Optional[str] = Header(None),
+                              principal: Principal = Security(get_fresh_principal), db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
     """update status order
 
     Args:
         id (int): order ID
         order (order_schema.OrderStatusModel): OrderStatus Schema
-        Authorize (AuthJWT, optional): user based on JWT. Defaults to Depends().
+        if_match (str, optional): ETag of the order as last seen by the client
 
     Raises:
         HTTPException: token validation error
+        HTTPException: order not found
+        HTTPException: 412 order changed since If-Match was taken
 
     Requests:
         dict:
@@ -326,41 +651,46 @@ async def update_order_status(id: int, order: OrderStatusModel, response: Respon
             same as place in order
         }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-    if user.is_staff:
-        update_order_status = db.query(
-            Order).filter(Order.id == id).first()
-        if update_order_status:
-            update_order_status.order_status = order.order_status
-            db.commit()
-            resp = {
-                "id": update_order_status.id,
-                "quantity": update_order_status.quantity,
-                "order_sizes": update_order_status.order_sizes,
-                "order_status": update_order_status.order_status,
-            }
-            response.status_code = status.HTTP_201_CREATED
-            return jsonable_encoder(resp)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Order not found"
+    if principal.is_staff:
+        version = if_match_version(if_match)
+        statement = (
+            update(Order)
+            .where(Order.id == id)
+            .values(order_status=order.order_status, version_id=Order.version_id + 1)
+            .returning(*ORDER_RETURNING)
+            .execution_options(synchronize_session=False)
+        )
+        if version is not None:
+            statement = statement.where(Order.version_id == version)
+        update_order_status = (await db.execute(statement)).first()
+        await db.commit()
+        if update_order_status is None:
+            raise await write_failure(db, id, version, principal) or HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Order changed concurrently, try again"
             )
+        response.headers["ETag"] = order_etag(update_order_status.version_id)
+        response.status_code = status.HTTP_201_CREATED
+        return jsonable_encoder(dict(update_order_status._mapping))
 
 
 # delete order
 @order_router.delete('/user/order/{id}')
-async def delete_order(id: int, response: Response, current_user: User = Security(get_current_user),
-                       db: Session = Depends(get_db)) -> jsonable_encoder:
-    """delete order
+async def delete_order(id: int, response: Response, if_match: Optional[str] = Header(None),
+                       principal: Principal = Security(get_current_principal),
+                       db: AsyncSession = Depends(get_db)) -> jsonable_encoder:
+    """delete order with one ``DELETE ... [AND version_id] RETURNING id``
+
+    Only the owner (or staff) can delete an order, others get a 404.
 
     Args:
         id (int): order ID
-        Authorize (AuthJWT, optional): user based on jwt. Defaults to Depends().
+        if_match (str, optional): ETag of the order as last seen by the client
 
     Raises:
         HTTPException: token validation error
         HTTPException: order existing Message
+        HTTPException: 412 order changed since If-Match was taken
     Requests:
         params:string
     Returns:
@@ -370,21 +700,96 @@ async def delete_order(id: int, response: Response, current_user: User = Securit
             "detail": string
         }
     """
-    user = db.query(User).filter(User.id == current_user['id']).first()
-    # if user.is_staff:
-    if user:
-        order_to_delete = db.query(Order).filter(Order.id == id).first()
-        if order_to_delete:
-            db.delete(order_to_delete)
-            db.commit()
-            resp = {
-                "id": order_to_delete.id,
-                "detail": "Order has been deleted"
-            }
-            response.status_code = status_code = status.HTTP_201_CREATED
-            return jsonable_encoder(resp)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Order not found"
-            )
+    version = if_match_version(if_match)
+    statement = owned_by(
+        delete(Order)
+        .where(Order.id == id)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False),
+        principal
+    )
+    if version is not None:
+        statement = statement.where(Order.version_id == version)
+    deleted_id = (await db.execute(statement)).scalar()
+    await db.commit()
+    if deleted_id is None:
+        raise await write_failure(db, id, version, principal) or HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order changed concurrently, try again"
+        )
+    resp = {
+        "id": deleted_id,
+        "detail": "Order has been deleted"
+    }
+    response.status_code = status.HTTP_201_CREATED
+    return jsonable_encoder(resp)
+
+
+async def export_rows(query, export_format: str):
+    """NDJSON lines or CSV rows, one chunk per ``EXPORT_YIELD_PER`` rows"""
+    names = [column.key for column in EXPORT_COLUMNS]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(names)
+    async with session_scope() as db:
+        async for rows in stream_rows(db, query, EXPORT_YIELD_PER):
+            for row in rows:
+                # ChoiceType columns come back as Choice objects, export their codes
+                values = [getattr(value, "code", value) for value in row]
+                if export_format == "csv":
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(names, values))))
+                    buffer.write("\n")
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+async def copy_export(query):
+    async with session_scope() as db:
+        async for chunk in copy_csv(db, query):
+            yield chunk
+
+
+# export orders
+@order_router.get('/export')
+async def export_orders(export_format: str = Query("ndjson", alias="format", regex="^(ndjson|csv)$"),
+                        copy: bool = False,
+                        order_status: Optional[str] = Query(None, regex=ORDER_STATUS_PATTERN),
+                        order_sizes: Optional[str] = Query(None, regex=ORDER_SIZE_PATTERN),
+                        user_id: Optional[int] = None,
+                        principal: Principal = Security(get_fresh_principal)) -> StreamingResponse:
+    """stream all matching orders as NDJSON or CSV (staff only, fresh token)
+
+    Rows come from a server-side cursor ``EXPORT_YIELD_PER`` at a time, so
+    memory stays flat for any number of orders. ``copy=true`` (CSV only) lets
+    postgres write the CSV with COPY ... TO STDOUT.
+
+    Args:
+        format (str): ndjson (default) or csv
+        copy (bool): use the COPY fast path, requires format=csv
+        order_status, order_sizes, user_id: same filters as /order_list
+
+    Raises:
+        HTTPException: 403 for non staff users
+        HTTPException: 400 for copy with ndjson
+    """
+    if not principal.is_staff:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Must be staff"
+        )
+    if copy and export_format != "csv":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="copy is only available for csv"
+        )
+    query = filter_orders(select(*EXPORT_COLUMNS), order_status, order_sizes, user_id).order_by(Order.id)
+    body = copy_export(query) if copy else export_rows(query, export_format)
+    return StreamingResponse(
+        body,
+        media_type="text/csv" if export_format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=orders.{export_format}"},
+    )
@@ -1,17 +1,27 @@
-from datetime import datetime
-from fastapi import APIRouter, Request,Header,Response
-from fastapi.exceptions import HTTPException
+from fastapi import APIRouter, Request,Depends
 from fastapi.responses import HTMLResponse, FileResponse
 import os
 from pathlib import Path
-from fastapi.templating import Jinja2Templates
-import threading   
+from decouple import config
+from utils.range_file import RangeFileResponse
+from utils.rate_limit import RateLimit
+from settings.static_assets import static_assets
 app_view = APIRouter()
 
-TEMPLATES = Jinja2Templates(directory="templates")
-CHUNK_SIZE = 1024*1024
+_templates = None
+VIDEO_ACCEL_REDIRECT = config('VIDEO_ACCEL_REDIRECT', default='')
 video_path = Path(os.path.dirname(os.path.dirname(__file__))+'/static/video.mp4')
 
+def templates():
+    """page templates, jinja2 is imported on the first page render"""
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory="templates")
+        _templates.env.globals["static_url"] = static_assets.url
+    return _templates
+
+
 @app_view.get("/")
 async def read_index(request: Request):
     context = {
@@ -19,45 +29,20 @@ async def read_index(request: Request):
         "title":"None Api route",
         "overview": "this is jinja2 test for fastapi",
     }
-    return TEMPLATES.TemplateResponse("index.html", context=context)
+    return templates().TemplateResponse("index.html", context=context)
 
 @app_view.get("/video")
-async def video_endpoint(range: str = Header(None)):
-    start, end = range.replace("bytes=", "").split("-")
-    start = int(start)
-    end = int(end) if end else start + CHUNK_SIZE
-    with open(video_path, "rb") as video:
-        video.seek(start)
-        data = video.read(end - start)
-        filesize = str(video_path.stat().st_size)
-        headers = {
-            'Content-Range': f'bytes {str(start)}-{str(end)}/{filesize}',
-            'Accept-Ranges': 'bytes'
-        }
-        return Response(data, status_code=206, headers=headers, media_type="video/mp4")
+async def video_endpoint(request: Request):
+    """video.mp4 with Range, If-Range and multipart byteranges support
+
+    With VIDEO_ACCEL_REDIRECT set (e.g. ``/internal/video/``) the file is
+    served by nginx from that internal location.
+    """
+    accel_redirect = VIDEO_ACCEL_REDIRECT + video_path.name if VIDEO_ACCEL_REDIRECT else None
+    return RangeFileResponse(str(video_path), request.headers, media_type="video/mp4",
+                             method=request.method, accel_redirect=accel_redirect)
     
     
-import datetime
-counter = 0
-lock = threading.Lock()
-_2min = datetime.datetime.now()+datetime.timedelta(seconds=3)
-@app_view.get("/test")
+@app_view.get("/test", dependencies=[Depends(RateLimit(times=2, seconds=3, per="route"))])
 def do_something():
-    global counter
-    global _2min
-    now = datetime.datetime.now()
-    try:
-        with lock:
-            counter += 1
-            if counter >= 3:
-                raise HTTPException(
-                    status_code=400,
-                    detail="stop spam"
-                )
-    except Exception as e:
-        if now > _2min:
-             counter = 0
-        raise HTTPException(
-            status_code=400
-        )
-    return {"message": "Hello World"}
\ No newline at end of file
+    return {"message": "Hello World"}
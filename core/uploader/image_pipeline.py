@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from starlette.concurrency import run_in_threadpool
+from decouple import config
+from settings import LOGGER
+from core.uploader.media_store import content_store
+import secrets
+import shutil
+import asyncio
+import os
+
+IMAGE_MAX_UPLOAD_SIZE = config('IMAGE_MAX_UPLOAD_SIZE', default=5 * 1024 * 1024, cast=int)
+IMAGE_MAX_PIXELS = config('IMAGE_MAX_PIXELS', default=40_000_000, cast=int)
+IMAGE_POOL_SIZE = config('IMAGE_POOL_SIZE', default=2, cast=int)
+IMAGE_RENDITIONS = config(
+    'IMAGE_RENDITIONS', default='64,200,512',
+    cast=lambda v: tuple(sorted({int(size) for size in v.split(',') if size.strip()})))
+# the rendition stored in UserProfile.image, the old single 200x200 resize
+IMAGE_DEFAULT_SIZE = 200
+CHUNK_SIZE = 64 * 1024
+
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """image format from the file signature, the client's filename is not trusted"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def render_renditions(source: str, directory: str, stem: str, fmt: str, sizes: Sequence[int]) -> dict:
+    """decode ``source`` once and write a square ``<stem>_<size>`` image per size
+
+    Every size is written in the upload's own format and as WebP. Runs on the
+    pipeline's pool, Pillow releases the GIL while decoding, resampling and
+    encoding.
+    """
+    from PIL import Image, ImageOps
+
+    renditions = {}
+    with Image.open(source) as img:
+        if img.width * img.height > IMAGE_MAX_PIXELS:
+            raise ValueError(f"image too large ({img.width}x{img.height})")
+        largest = max(sizes)
+        # JPEG only: let the decoder downscale by 1/2..1/8 while still covering the largest rendition
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        if fmt == "jpeg":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("LA", "PA", "P") or "transparency" in img.info else "RGB")
+        # largest first, each size is resampled from the previous rendition rather than the full image
+        for size in sorted(sizes, reverse=True):
+            img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+            base = os.path.join(directory, f"{stem}_{size}")
+            paths = {"webp": f"{base}.webp"}
+            if fmt != "webp":
+                paths[fmt] = f"{base}.{EXTENSIONS[fmt]}"
+                img.save(paths[fmt], fmt.upper(), optimize=True, quality=85)
+            img.save(paths["webp"], "WEBP", quality=80, method=4)
+            renditions[size] = paths
+    return renditions
+
+
+def default_rendition(renditions: dict) -> str:
+    """the IMAGE_DEFAULT_SIZE rendition, in the upload's format when it is not WebP"""
+    paths = renditions.get(IMAGE_DEFAULT_SIZE) or renditions[max(renditions)]
+    return next((path for fmt, path in paths.items() if fmt != "webp"), paths["webp"])
+
+
+class ImagePipeline:
+    """uploads are streamed to disk and turned into renditions off the event loop
+
+    The upload is copied in ``CHUNK_SIZE`` pieces and rejected as soon as it
+    goes over ``max_upload_size`` or its first bytes are not a supported image.
+    """
+
+    def __init__(self, pool_size: int, max_upload_size: int, sizes: Sequence[int]) -> None:
+        self.pool_size = pool_size
+        self.max_upload_size = max_upload_size
+        self.sizes = tuple(sizes)
+        self._executor = None
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="image")
+            LOGGER.info(f'image pipeline started ({self.pool_size} threads)')
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """run a Pillow job on the pipeline's pool"""
+        self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def receive(self, file, directory: str) -> tuple:
+        """copy the upload into ``directory``
+
+        Raises:
+            HTTPException: 406 unsupported image format
+            HTTPException: 413 upload bigger than max_upload_size
+
+        Returns:
+            tuple: (temporary path, sniffed format)
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f".upload-{secrets.token_hex(8)}")
+        fmt, size = None, 0
+        out = await run_in_threadpool(open, path, "wb")
+        try:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if fmt is None:
+                    fmt = sniff_format(chunk[:16])
+                    if fmt is None:
+                        raise HTTPException(
+                            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail="file extension is not valid"
+                        )
+                size += len(chunk)
+                if size > self.max_upload_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"image is larger than {self.max_upload_size} bytes"
+                    )
+                await run_in_threadpool(out.write, chunk)
+            if fmt is None:
+                raise HTTPException(
+                    status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                    detail="file extension is not valid"
+                )
+        except BaseException:
+            out.close()
+            os.remove(path)
+            raise
+        out.close()
+        return path, fmt
+
+    async def process(self, file, directory: str, stem: str) -> dict:
+        """receive ``file`` and write all renditions, the raw upload is not kept
+
+        Raises:
+            HTTPException: 400 when the image can not be decoded
+
+        Returns:
+            dict: size -> {format: path}
+        """
+        # Pillow is only imported by workers that actually see an upload
+        from PIL import Image, UnidentifiedImageError
+
+        source, fmt = await self.receive(file, directory)
+        try:
+            return await self.run(render_renditions, source, directory, stem, fmt, self.sizes)
+        except (UnidentifiedImageError, ValueError, OSError, Image.DecompressionBombError) as e:
+            LOGGER.error(f'image processing failed: {e}')
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="image could not be processed"
+            )
+        finally:
+            os.remove(source)
+
+    async def profile_image(self, file) -> tuple:
+        """store a profile picture in the content addressed media store
+
+        Returns:
+            tuple: (path of the IMAGE_DEFAULT_SIZE rendition in the upload's format, all renditions)
+        """
+        staging = await run_in_threadpool(content_store.staging)
+        try:
+            renditions = await self.process(file, staging, "image")
+            digest = await run_in_threadpool(content_store.commit, staging)
+        except BaseException:
+            await run_in_threadpool(shutil.rmtree, staging, True)
+            raise
+        blob = content_store.blob_path(digest)
+        renditions = {
+            size: {fmt: os.path.join(blob, os.path.basename(path)) for fmt, path in paths.items()}
+            for size, paths in renditions.items()
+        }
+        return default_rendition(renditions), renditions
+
+image_pipeline = ImagePipeline(
+    pool_size=IMAGE_POOL_SIZE,
+    max_upload_size=IMAGE_MAX_UPLOAD_SIZE,
+    sizes=IMAGE_RENDITIONS,
+)
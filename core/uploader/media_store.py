@@ -0,0 +1,135 @@
+from typing import Optional
+from sqlalchemy import select, func
+from starlette.concurrency import run_in_threadpool
+from decouple import config
+from db import session_scope, UserProfile
+from settings import LOGGER
+import hashlib
+import secrets
+import shutil
+import time
+import sys
+import os
+
+MEDIA_CAS_ROOT = "media/cas"
+MEDIA_GC_GRACE = config('MEDIA_GC_GRACE', default=3600, cast=int)
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentStore:
+    """content addressed blobs under ``<root>/ab/cd/<sha256>/``
+
+    A blob is the directory of renditions produced from one upload, its name is
+    the SHA-256 of the rendition files, so uploading the same picture again
+    reuses the existing blob. URLs never change content and can be cached
+    forever. ``UserProfile.image`` rows are the references, indexed through
+    ``UserProfile.image_digest``: ``release`` drops a blob once its last
+    profile moved away and ``collect_garbage`` sweeps
+    everything unreferenced. Blobs younger than ``grace`` seconds are kept,
+    they may belong to an upload whose profile row is not committed yet.
+    """
+
+    def __init__(self, root: str, grace: int) -> None:
+        self.root = root
+        self.grace = grace
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def digest_of(self, url: Optional[str]) -> Optional[str]:
+        """blob digest of a stored url, None for files outside the store"""
+        if not url:
+            return None
+        parts = os.path.normpath(url.lstrip("/")).split(os.sep)
+        root = os.path.normpath(self.root).split(os.sep)
+        if parts[:len(root)] != root or len(parts) < len(root) + 3:
+            return None
+        return parts[len(root) + 2]
+
+    def staging(self) -> str:
+        path = os.path.join(self.root, ".staging", secrets.token_hex(8))
+        os.makedirs(path)
+        return path
+
+    @staticmethod
+    def _digest(directory: str) -> str:
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            digest.update(name.encode() + b"\0")
+            with open(os.path.join(directory, name), "rb") as source:
+                for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def commit(self, staging: str) -> str:
+        """move a staging directory to its content address, dropping it when the blob exists"""
+        digest = self._digest(staging)
+        target = self.blob_path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            if not os.path.isdir(target):
+                raise
+            shutil.rmtree(staging, ignore_errors=True)
+            # a fresh reference: keep the sweeper away for another grace period
+            os.utime(target)
+        return digest
+
+    def _remove(self, digest: str) -> bool:
+        path = self.blob_path(digest)
+        try:
+            if time.time() - os.stat(path).st_mtime < self.grace:
+                return False
+        except FileNotFoundError:
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    async def release(self, db, url: Optional[str]) -> bool:
+        """delete the blob behind ``url`` when no profile references it any more"""
+        digest = self.digest_of(url)
+        if digest is None:
+            return False
+        references = (await db.execute(select(func.count()).select_from(UserProfile).where(
+            UserProfile.image_digest == digest))).scalar()
+        if references:
+            return False
+        return await run_in_threadpool(self._remove, digest)
+
+    def sweep(self, referenced: set) -> int:
+        removed = 0
+        now = time.time()
+        for shard in os.listdir(self.root) if os.path.isdir(self.root) else ():
+            shard_path = os.path.join(self.root, shard)
+            if shard == ".staging":
+                # leftovers of crashed uploads
+                for name in os.listdir(shard_path):
+                    path = os.path.join(shard_path, name)
+                    if now - os.stat(path).st_mtime > self.grace:
+                        shutil.rmtree(path, ignore_errors=True)
+                continue
+            for sub_shard in os.listdir(shard_path):
+                for digest in os.listdir(os.path.join(shard_path, sub_shard)):
+                    if digest not in referenced and self._remove(digest):
+                        removed += 1
+        return removed
+
+    async def collect_garbage(self) -> int:
+        """mark every blob referenced from user_profile.image, sweep the rest"""
+        async with session_scope() as db:
+            images = (await db.execute(select(UserProfile.image).distinct())).scalars().all()
+        referenced = {self.digest_of(str(image)) for image in images} - {None}
+        removed = await run_in_threadpool(self.sweep, referenced)
+        LOGGER.info(f'media gc: {len(referenced)} blobs referenced, {removed} removed')
+        return removed
+
+
+content_store = ContentStore(MEDIA_CAS_ROOT, MEDIA_GC_GRACE)
+
+
+if __name__ == "__main__":
+    import asyncio
+    if len(sys.argv) != 2 or sys.argv[1] != "gc":
+        sys.exit("usage: python -m core.uploader.media_store gc")
+    print(f"{asyncio.run(content_store.collect_garbage())} blobs removed")
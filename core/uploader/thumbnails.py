@@ -0,0 +1,241 @@
+from collections import OrderedDict
+from typing import Optional
+from fastapi import APIRouter, Path, Query, Header, status
+from fastapi.exceptions import HTTPException
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from decouple import config
+from settings import LOGGER
+from core.uploader.image_pipeline import image_pipeline, EXTENSIONS, IMAGE_RENDITIONS, IMAGE_DEFAULT_SIZE
+from core.uploader.media_store import content_store
+import asyncio
+import io
+import os
+
+THUMB_CACHE_DIR = config('THUMB_CACHE_DIR', default='cache/thumbs')
+THUMB_CACHE_BYTES = config('THUMB_CACHE_BYTES', default=256 * 1024 * 1024, cast=int)
+THUMB_MEMORY_BYTES = config('THUMB_MEMORY_BYTES', default=16 * 1024 * 1024, cast=int)
+# thumbnails are cut from the largest stored rendition, never upscaled beyond it
+THUMB_MAX_SIZE = max(IMAGE_RENDITIONS)
+SOURCE_CACHE_SIZE = 1024
+MEDIA_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+thumb_router = APIRouter(
+    prefix='/media',
+    tags=['upload']
+)
+
+
+def render_thumbnail(source: str, width: int, height: int, fmt: str) -> bytes:
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as img:
+        img.draft("RGB", (width, height))
+        if fmt == "jpeg":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        img = ImageOps.fit(img, (width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, fmt.upper(), optimize=True, quality=85)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """derived images of media store blobs: memory tier -> LRU disk cache -> render
+
+    The disk cache is bounded by ``disk_budget`` bytes and evicts the least
+    recently used files, the memory tier keeps the hottest ``memory_budget``
+    bytes. Concurrent requests for the same variant wait on one render.
+    Each worker keeps its own index; a file evicted by another worker is
+    simply rendered again.
+    """
+
+    def __init__(self, directory: str, disk_budget: int, memory_budget: int) -> None:
+        self.directory = directory
+        self.disk_budget = disk_budget
+        self.memory_budget = memory_budget
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._sources = OrderedDict()
+        self._inflight = {}
+        self._loaded = False
+
+    async def start(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            await run_in_threadpool(self._load)
+
+    def _load(self) -> None:
+        """index what earlier runs left on disk, oldest first"""
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                stat = os.stat(os.path.join(root, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        LOGGER.info(f'thumbnail cache loaded ({len(self._disk)} files, {self._disk_bytes} bytes)')
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+    def _remember(self, name: str, data: bytes) -> None:
+        if len(data) > self.memory_budget // 4:
+            return
+        self._memory[name] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _write(self, name: str, data: bytes, evicted: list) -> None:
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as out:
+            out.write(data)
+        os.replace(temporary, path)
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as source:
+                data = source.read()
+            os.utime(self._path(name))
+            return data
+        except FileNotFoundError:
+            return None
+
+    async def source(self, digest: str) -> tuple:
+        """largest stored rendition of a blob, preferring the upload's own format
+
+        Raises:
+            HTTPException: 404 unknown blob
+
+        Returns:
+            tuple: (path, format)
+        """
+        cached = self._sources.get(digest)
+        if cached is not None:
+            return cached
+        blob = content_store.blob_path(digest)
+        try:
+            names = await run_in_threadpool(os.listdir, blob)
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="image does not exists"
+            )
+        formats = {extension: fmt for fmt, extension in EXTENSIONS.items()}
+        candidates = []
+        for name in names:
+            stem, _, extension = name.rpartition(".")
+            if extension in formats and stem.rpartition("_")[2].isdigit():
+                candidates.append((int(stem.rpartition("_")[2]), extension != "webp", name, formats[extension]))
+        if not candidates:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="image does not exists"
+            )
+        _, _, name, fmt = max(candidates)
+        self._sources[digest] = (os.path.join(blob, name), fmt)
+        while len(self._sources) > SOURCE_CACHE_SIZE:
+            self._sources.popitem(last=False)
+        return self._sources[digest]
+
+    async def _produce(self, name: str, digest: str, width: int, height: int, fmt: str) -> bytes:
+        if name in self._disk:
+            data = await run_in_threadpool(self._read, name)
+            if data is not None:
+                self.disk_hits += 1
+                self._disk.move_to_end(name)
+                self._remember(name, data)
+                return data
+            self._disk_bytes -= self._disk.pop(name)
+        source, _ = await self.source(digest)
+        data = await image_pipeline.run(render_thumbnail, source, width, height, fmt)
+        self.renders += 1
+        self._disk[name] = len(data)
+        self._disk_bytes += len(data)
+        evicted = []
+        while self._disk_bytes > self.disk_budget and len(self._disk) > 1:
+            old, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(old)
+        await run_in_threadpool(self._write, name, data, evicted)
+        self._remember(name, data)
+        return data
+
+    async def get(self, digest: str, width: int, height: int, fmt: str) -> bytes:
+        await self.start()
+        name = f"{digest}_{width}x{height}.{EXTENSIONS[fmt]}"
+        data = self._memory.get(name)
+        if data is not None:
+            self.memory_hits += 1
+            self._memory.move_to_end(name)
+            return data
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._produce(name, digest, width, height, fmt))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        # shielded: a client going away must not cancel the render others wait for
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "renders": self.renders,
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "disk_files": len(self._disk),
+        }
+
+
+thumbnail_cache = ThumbnailCache(THUMB_CACHE_DIR, THUMB_CACHE_BYTES, THUMB_MEMORY_BYTES)
+
+
+@thumb_router.get('/thumb/{id}')
+async def thumbnail(id: str = Path(..., regex="^[0-9a-f]{64}$"),
+                    w: Optional[int] = Query(None, ge=1, le=THUMB_MAX_SIZE),
+                    h: Optional[int] = Query(None, ge=1, le=THUMB_MAX_SIZE),
+                    fmt: Optional[str] = Query(None, regex="^(jpeg|png|webp)$"),
+                    if_none_match: Optional[str] = Header(None)) -> Response:
+    """resized copy of a profile image from the media store
+
+    Args:
+        id (str): blob digest, the ``<digest>`` directory of a /media/cas url
+        w (int, optional): width, defaults to h or 200
+        h (int, optional): height, defaults to w or 200
+        fmt (str, optional): jpeg, png or webp, defaults to the uploaded format
+
+    Raises:
+        HTTPException: 404 unknown image
+
+    Returns:
+        Response: the image, cacheable forever since blobs never change
+    """
+    width = w or h or IMAGE_DEFAULT_SIZE
+    height = h or w or IMAGE_DEFAULT_SIZE
+    if fmt is None:
+        _, fmt = await thumbnail_cache.source(id)
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{id}-{width}x{height}-{fmt}"',
+    }
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    data = await thumbnail_cache.get(id, width, height, fmt)
+    return Response(content=data, media_type=MEDIA_TYPES[fmt], headers=headers)
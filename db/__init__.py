@@ -1,7 +1,18 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import database as DB
 from .database import init_db, Base
 from .auth_config.auth_handler import AuthHandler
+from .auth_config.password_hasher import password_hasher
+from .auth_config.denylist import token_denylist
+from .auth_config.token_cache import token_cache
+from .auth_config.user_status import user_status_cache
+from .auth_config.verification_codes import (
+    verification_codes,
+    PASSWORD_RESET,
+    VALID as VERIFY_VALID,
+    EXPIRED as VERIFY_EXPIRED,
+    LOCKED as VERIFY_LOCKED,
+)
 from .schema.auth_schema import (
     LoginModel,
     SignUpModel,
@@ -10,6 +21,9 @@ from .schema.auth_schema import (
     Settings,
     GetCodeSchema,
     get_current_user,
+    Principal,
+    get_current_principal,
+    get_fresh_principal,
 )
 from .models.user import (
     User,
@@ -23,8 +37,16 @@ from .models.order import (
 from .schema.order_schema import (
     OrderModel,
     OrderStatusModel,
-    OrderTest
+    OrderTest,
+    OrderIdsModel,
 )
 redis_client = DB.redis_conn
+async_redis_client = DB.async_redis_conn
 get_db = DB.get_db
-get_session = Session
+get_session = AsyncSession
+session_scope = DB.session_scope
+constraint_name = DB.constraint_name
+copy_records = DB.copy_records
+estimate_rows = DB.estimate_rows
+stream_rows = DB.stream_rows
+copy_csv = DB.copy_csv
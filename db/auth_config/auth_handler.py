@@ -1,21 +1,27 @@
-from fastapi_jwt_auth import AuthJWT
 from fastapi import status, Depends
 from fastapi.exceptions import HTTPException
-from werkzeug.security import generate_password_hash, check_password_hash
+from .password_hasher import password_hasher
+from .token_cache import CachedAuthJWT
+from utils.openapi import requires_jwt
 
 
 class AuthHandler:
 
     @staticmethod
-    def verify_password(hashed_password, plain_password):
-        return check_password_hash(hashed_password, plain_password)
+    async def verify_password(hashed_password, plain_password):
+        return await password_hasher.verify(hashed_password, plain_password)
 
     @staticmethod
-    def get_password_hash(password):
-        return generate_password_hash(password)
+    async def get_password_hash(password):
+        return await password_hasher.hash(password)
 
     @staticmethod
-    def Token_requirement(Authorize: AuthJWT = Depends()):
+    def needs_rehash(hashed_password):
+        return password_hasher.needs_rehash(hashed_password)
+
+    @staticmethod
+    @requires_jwt
+    def Token_requirement(Authorize: CachedAuthJWT = Depends()):
         try:
             Authorize.jwt_required()
         except Exception as e:
@@ -26,7 +32,8 @@ class AuthHandler:
         return Authorize
 
     @staticmethod
-    def Refresh_token_requirement(Authorize: AuthJWT = Depends()):
+    @requires_jwt
+    def Refresh_token_requirement(Authorize: CachedAuthJWT = Depends()):
         try:
             Authorize.jwt_refresh_token_required()
         except Exception as e:
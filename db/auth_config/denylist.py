@@ -0,0 +1,309 @@
+from collections import OrderedDict
+from datetime import timedelta
+from hashlib import blake2b
+from decouple import config
+from settings import LOGGER
+from db.database import redis_conn, async_redis_conn
+from redis.exceptions import ResponseError
+import asyncio
+import threading
+import math
+import time
+
+DENYLIST_PREFIX = "denylist:"
+DENYLIST_CHANNEL = "denylist"
+GENERATION_KEY = "token_gen"
+# releases before the denylist module stored revocations under the bare jti (a uuid4)
+LEGACY_KEY_PATTERN = "????????-????-????-????-????????????"
+GENERATION_CHANNEL = "token_gen"
+DENYLIST_MAXSIZE = config('DENYLIST_MAXSIZE', default=100_000, cast=int)
+DENYLIST_BLOOM = config('DENYLIST_BLOOM', default=True, cast=bool)
+DENYLIST_BLOOM_CAPACITY = config('DENYLIST_BLOOM_CAPACITY', default=200_000, cast=int)
+DENYLIST_BLOOM_ERROR_RATE = config('DENYLIST_BLOOM_ERROR_RATE', default=0.001, cast=float)
+# redis lookups running at once per worker and seconds a lookup waits for a slot
+DENYLIST_REMOTE_CONCURRENCY = config('DENYLIST_REMOTE_CONCURRENCY', default=8, cast=int)
+DENYLIST_REMOTE_WAIT = config('DENYLIST_REMOTE_WAIT', default=0.5, cast=float)
+DENYLIST_FAIL_OPEN = config('DENYLIST_FAIL_OPEN', default=False, cast=bool)
+
+
+class BloomFilter:
+    """fixed size bloom filter, ``in`` may give false positives but never false negatives"""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class TTLSet:
+    """bounded set whose members expire, oldest insertions are evicted first"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.evicted = False
+        self._data = OrderedDict()
+
+    def add(self, key: str, ttl: float) -> None:
+        self._data[key] = time.monotonic() + ttl
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evicted = True
+
+    def __contains__(self, key: str) -> bool:
+        expires = self._data.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self):
+        now = time.monotonic()
+        return [key for key, expires in self._data.items() if expires >= now]
+
+
+def migrate_legacy_keys(redis) -> int:
+    """move revocations kept under bare jti keys to ``denylist:<jti>``, their TTL is kept
+
+    Run once per deploy (init_db) before the workers start, otherwise tokens
+    revoked by older releases would be accepted again.
+    """
+    moved = 0
+    for key in redis.scan_iter(match=LEGACY_KEY_PATTERN, count=1000):
+        if redis.get(key) != 'true':
+            continue
+        try:
+            if redis.renamenx(key, DENYLIST_PREFIX + key):
+                moved += 1
+            else:
+                # already revoked under the new key
+                redis.delete(key)
+        except ResponseError:
+            # expired between GET and RENAMENX
+            pass
+    return moved
+
+
+class TokenDenylist:
+    """Per-worker view of the revoked JTIs and token generations kept in Redis.
+
+    Every worker holds the revoked JTIs in a bounded TTL set, optionally behind
+    a bloom filter, and follows revocations from the other workers over Redis
+    pub/sub. A non revoked token is answered locally; Redis is only asked when
+    the local view can not be trusted (not synced yet, set overflowed, or a
+    bloom false positive).
+
+    Tokens also carry the user's generation number (``gen`` claim). Bumping a
+    user's generation revokes every token issued before it in one write, the
+    counters live in the ``token_gen`` hash and are mirrored the same way.
+
+    The checks are synchronous (fastapi_jwt_auth calls them from
+    jwt_required) and must only run in the threadpool, never on the event
+    loop. Redis lookups are capped at ``remote_concurrency`` per worker; a
+    lookup that gets no slot in time, or fails, counts the token as revoked
+    unless ``fail_open``.
+    """
+
+    def __init__(self, redis, async_redis, maxsize: int = DENYLIST_MAXSIZE, bloom: bool = DENYLIST_BLOOM,
+                 bloom_capacity: int = DENYLIST_BLOOM_CAPACITY,
+                 bloom_error_rate: float = DENYLIST_BLOOM_ERROR_RATE,
+                 remote_concurrency: int = DENYLIST_REMOTE_CONCURRENCY,
+                 remote_wait: float = DENYLIST_REMOTE_WAIT, fail_open: bool = DENYLIST_FAIL_OPEN) -> None:
+        self.redis = redis
+        self.async_redis = async_redis
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self._entries = TTLSet(maxsize)
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate) if bloom else None
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._remote_slots = threading.BoundedSemaphore(remote_concurrency)
+        self.remote_wait = remote_wait
+        self.fail_open = fail_open
+        self._synced = False
+        self._task = None
+        self.remote_lookups = 0
+        self.remote_failures = 0
+
+    @staticmethod
+    def _seconds(ttl) -> int:
+        return int(ttl.total_seconds()) if isinstance(ttl, timedelta) else int(ttl)
+
+    def _add_local(self, jti: str, ttl: int) -> None:
+        with self._lock:
+            self._entries.add(jti, ttl)
+            if self._bloom is not None:
+                if self._bloom.count >= self.bloom_capacity and not self._entries.evicted:
+                    self._rebuild_bloom()
+                self._bloom.add(jti)
+
+    def _rebuild_bloom(self) -> None:
+        bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        for key in self._entries.keys():
+            bloom.add(key)
+        self._bloom = bloom
+
+    def _remote(self, command, *args):
+        """one bounded redis call: (True, reply), or (False, None) when no slot was free in time or redis failed"""
+        if not self._remote_slots.acquire(timeout=self.remote_wait):
+            self.remote_failures += 1
+            LOGGER.warning('token denylist: no free redis slot')
+            return False, None
+        try:
+            self.remote_lookups += 1
+            return True, command(*args)
+        except Exception as e:
+            self.remote_failures += 1
+            LOGGER.error(f'token denylist lookup failed: {e}')
+            return False, None
+        finally:
+            self._remote_slots.release()
+
+    def is_revoked(self, jti: str) -> bool:
+        if self._synced:
+            with self._lock:
+                if self._bloom is not None and jti not in self._bloom:
+                    return False
+                if jti in self._entries:
+                    return True
+                if self._bloom is None and not self._entries.evicted:
+                    return False
+        # local view is incomplete, ask the source of truth
+        answered, ttl = self._remote(self.redis.ttl, DENYLIST_PREFIX + jti)
+        if not answered:
+            return not self.fail_open
+        if ttl is not None and ttl > 0:
+            self._add_local(jti, ttl)
+            return True
+        return False
+
+    def is_stale(self, decrypted_token: dict) -> bool:
+        """token was issued before the user's last generation bump"""
+        claims = decrypted_token.get(decrypted_token.get('sub'))
+        if not isinstance(claims, dict) or 'id' not in claims:
+            return False
+        user_id = int(claims['id'])
+        if self._synced:
+            current = self._generations.get(user_id, 0)
+        else:
+            answered, current = self._remote(self.redis.hget, GENERATION_KEY, user_id)
+            if not answered:
+                return not self.fail_open
+            current = int(current or 0)
+        return decrypted_token.get('gen', 0) < current
+
+    def stats(self) -> dict:
+        return {
+            "synced": self._synced,
+            "entries": len(self._entries),
+            "remote_lookups": self.remote_lookups,
+            "remote_failures": self.remote_failures,
+        }
+
+    def is_token_revoked(self, decrypted_token: dict) -> bool:
+        return self.is_revoked(decrypted_token['jti']) or self.is_stale(decrypted_token)
+
+    async def generation(self, user_id: int) -> int:
+        """current generation for a token being issued, always read from redis
+
+        The local mirror may not have seen a bump from another worker yet, a
+        token minted from it would turn stale as soon as the mirror catches up.
+        """
+        generation = int(await self.async_redis.hget(GENERATION_KEY, user_id) or 0)
+        self._set_generation(user_id, generation)
+        return generation
+
+    async def bump_generation(self, user_id: int) -> int:
+        """revoke every outstanding token of the user"""
+        generation = await self.async_redis.hincrby(GENERATION_KEY, user_id, 1)
+        await self.async_redis.publish(GENERATION_CHANNEL, f"{user_id}:{generation}")
+        self._set_generation(user_id, generation)
+        return generation
+
+    def _set_generation(self, user_id: int, generation: int) -> None:
+        # messages can arrive out of order, a generation never goes back
+        if generation > self._generations.get(user_id, 0):
+            self._generations[user_id] = generation
+
+    def revoke(self, jti: str, ttl) -> None:
+        seconds = self._seconds(ttl)
+        pipe = self.redis.pipeline()
+        pipe.setex(DENYLIST_PREFIX + jti, seconds, 'true')
+        pipe.publish(DENYLIST_CHANNEL, f"{jti}:{seconds}")
+        pipe.execute()
+        self._add_local(jti, seconds)
+
+    async def _warm(self) -> None:
+        keys = [key async for key in self.async_redis.scan_iter(match=f"{DENYLIST_PREFIX}*", count=1000)]
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            pipe = self.async_redis.pipeline()
+            for key in chunk:
+                pipe.ttl(key)
+            for key, ttl in zip(chunk, await pipe.execute()):
+                if ttl and ttl > 0:
+                    self._add_local(key[len(DENYLIST_PREFIX):], ttl)
+        generations = await self.async_redis.hgetall(GENERATION_KEY)
+        for user_id, generation in generations.items():
+            self._set_generation(int(user_id), int(generation))
+        LOGGER.info(f'token denylist warmed with {len(keys)} entries, {len(generations)} generations')
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.async_redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                # subscribe before warming so nothing published in between is missed
+                await pubsub.subscribe(DENYLIST_CHANNEL, GENERATION_CHANNEL)
+                await self._warm()
+                self._synced = True
+                async for message in pubsub.listen():
+                    key, _, value = message['data'].rpartition(':')
+                    if message['channel'] == GENERATION_CHANNEL:
+                        self._set_generation(int(key), int(value))
+                    else:
+                        self._add_local(key, int(value))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f'token denylist listener lost redis: {e}')
+            finally:
+                self._synced = False
+                await pubsub.close()
+            await asyncio.sleep(1)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+token_denylist = TokenDenylist(redis_conn, async_redis_conn)
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from decouple import config
+from settings import LOGGER
+import multiprocessing
+import asyncio
+
+HASH_POOL_SIZE = config('HASH_POOL_SIZE', default=2, cast=int)
+HASH_QUEUE_SIZE = config('HASH_QUEUE_SIZE', default=32, cast=int)
+HASH_METHOD = config('HASH_METHOD', default='pbkdf2:sha256:260000')
+HASH_SALT_LENGTH = config('HASH_SALT_LENGTH', default=16, cast=int)
+
+
+def generate_password_hash(password: str, method: str, salt_length: int) -> str:
+    # werkzeug is imported in the hasher processes, the API workers never load it
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(password, method, salt_length)
+
+
+def check_password_hash(hashed_password: str, plain_password: str) -> bool:
+    from werkzeug.security import check_password_hash
+    return check_password_hash(hashed_password, plain_password)
+
+
+class PasswordHasher:
+    """PBKDF2 hashing on a bounded process pool.
+
+    Hashing costs tens of milliseconds of pure CPU, so it is kept off the event
+    loop. At most ``pool_size + queue_size`` jobs may be in flight per worker;
+    anything beyond that is rejected with 503 instead of queueing unbounded.
+    """
+
+    def __init__(self, pool_size: int, queue_size: int, method: str, salt_length: int) -> None:
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.method = method
+        self.salt_length = salt_length
+        self._executor = None
+        self._pending = 0
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn: never fork a process that is running an event loop and a threadpool
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.pool_size, mp_context=multiprocessing.get_context('spawn'))
+            LOGGER.info(f'password hasher pool started ({self.pool_size} processes)')
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _submit(self, fn, *args):
+        if self._pending >= self.pool_size + self.queue_size:
+            LOGGER.error('password hasher saturated')
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Service busy, try again later",
+                headers={"Retry-After": "1"}
+            )
+        self.start()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(generate_password_hash, password, self.method, self.salt_length)
+
+    async def verify(self, hashed_password: str, plain_password: str) -> bool:
+        return await self._submit(check_password_hash, hashed_password, plain_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """True when the stored hash was made with other parameters than the current ones
+
+        werkzeug stores hashes as ``method$salt$hash``, e.g. ``pbkdf2:sha256:260000$salt$hash``.
+        """
+        if hashed_password.count('$') < 2:
+            return True
+        method, salt, _ = hashed_password.split('$', 2)
+        return method != self.method or len(salt) < self.salt_length
+
+    @staticmethod
+    def bulk_executor(processes: int = None) -> ProcessPoolExecutor:
+        """separate pool for bulk jobs, so they never queue in front of logins"""
+        return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+    async def hash_many(self, passwords, executor: ProcessPoolExecutor) -> list:
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(executor, generate_password_hash, password, self.method, self.salt_length)
+            for password in passwords
+        ))
+
+
+password_hasher = PasswordHasher(
+    pool_size=HASH_POOL_SIZE,
+    queue_size=HASH_QUEUE_SIZE,
+    method=HASH_METHOD,
+    salt_length=HASH_SALT_LENGTH,
+)
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Optional
+from fastapi_jwt_auth import AuthJWT
+from fastapi_jwt_auth.exceptions import RevokedTokenError
+from decouple import config
+import threading
+import time
+
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10_000, cast=int)
+
+
+class VerifiedTokenCache:
+    """LRU of decoded claims for tokens whose signature was already checked
+
+    Keys are a digest of the raw token (plus the issuer it was checked against),
+    entries die at the token's ``exp``. Claims are shared between requests and
+    must be treated as read-only.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(encoded_token: str, issuer: Optional[str] = None) -> bytes:
+        return blake2b(f"{issuer}:{encoded_token}".encode(), digest_size=20).digest()
+
+    def get(self, encoded_token: str, issuer: Optional[str] = None) -> Optional[dict]:
+        key = self._key(encoded_token, issuer)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, claims = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, encoded_token: str, claims: dict, issuer: Optional[str] = None) -> None:
+        key = self._key(encoded_token, issuer)
+        with self._lock:
+            self._data[key] = (claims.get('exp'), claims)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, encoded_token: str) -> None:
+        with self._lock:
+            for issuer in {None, AuthJWT._decode_issuer}:
+                self._data.pop(self._key(encoded_token, issuer), None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+token_cache = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+
+class CachedAuthJWT(AuthJWT):
+    """AuthJWT that verifies a given token's signature once per worker
+
+    fastapi_jwt_auth decodes the token again in jwt_required, get_raw_jwt and
+    get_jwt_subject, the cache turns all but the first of those into a lookup.
+    """
+
+    def _verified_token(self, encoded_token: str, issuer: Optional[str] = None) -> dict:
+        claims = token_cache.get(encoded_token, issuer)
+        if claims is None:
+            claims = super()._verified_token(encoded_token, issuer)
+            token_cache.put(encoded_token, claims, issuer)
+        return claims
+
+    def _verifying_token(self, encoded_token: str, issuer: Optional[str] = None) -> None:
+        try:
+            super()._verifying_token(encoded_token, issuer)
+        except RevokedTokenError:
+            token_cache.discard(encoded_token)
+            raise
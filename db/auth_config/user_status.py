@@ -0,0 +1,40 @@
+from typing import Optional
+from sqlalchemy import select
+from decouple import config
+from db.database import async_redis_conn, session_scope
+from db.models.user import User
+
+USER_STATUS_PREFIX = "user_status:"
+USER_STATUS_TTL = config('USER_STATUS_TTL', default=60, cast=int)
+
+
+class UserStatusCache:
+    """is_active/is_staff of a user, read through Redis with a short TTL
+
+    Only used where the JWT claims are not fresh enough. No endpoint changes
+    the flags, a change made in the database shows within USER_STATUS_TTL.
+    """
+
+    def __init__(self, redis, ttl: int) -> None:
+        self.redis = redis
+        self.ttl = ttl
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        key = f"{USER_STATUS_PREFIX}{user_id}"
+        cached = await self.redis.hgetall(key)
+        if cached:
+            return {name: value == "1" for name, value in cached.items()}
+        async with session_scope() as db:
+            row = (await db.execute(select(User.is_active, User.is_staff).where(
+                User.id == user_id))).first()
+        if row is None:
+            return None
+        state = {"is_active": bool(row.is_active), "is_staff": bool(row.is_staff)}
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={name: int(value) for name, value in state.items()})
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+        return state
+
+
+user_status_cache = UserStatusCache(async_redis_conn, USER_STATUS_TTL)
@@ -0,0 +1,94 @@
+from decouple import config
+from db.database import async_redis_conn
+import time
+
+VERIFY_CODE_STORE = config('VERIFY_CODE_STORE', default='redis')
+VERIFY_CODE_TTL = config('VERIFY_CODE_TTL', default=300, cast=int)
+VERIFY_CODE_MAX_ATTEMPTS = config('VERIFY_CODE_MAX_ATTEMPTS', default=5, cast=int)
+
+PASSWORD_RESET = "password_reset"
+
+# verify results
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"
+LOCKED = "locked"
+
+VERIFY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 'expired'
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if attempts > tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    return 'locked'
+end
+if redis.call('HGET', KEYS[1], 'code') == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 'valid'
+end
+return 'invalid'
+"""
+
+
+class RedisCodeStore:
+    """one live code per user and purpose, expiry and attempt counting done by Redis
+
+    Issuing a new code replaces the previous one, a code is deleted on first
+    successful use or after ``max_attempts`` wrong guesses.
+    """
+
+    def __init__(self, redis, ttl: int, max_attempts: int) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._verify = None
+
+    @staticmethod
+    def _key(user_id: int, purpose: str) -> str:
+        return f"verify:{purpose}:{user_id}"
+
+    async def issue(self, user_id: int, purpose: str, code: str) -> None:
+        key = self._key(user_id, purpose)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping={"code": code, "attempts": 0})
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def verify(self, user_id: int, purpose: str, code: str) -> str:
+        if self._verify is None:
+            self._verify = self.redis.register_script(VERIFY_SCRIPT)
+        return await self._verify(keys=[self._key(user_id, purpose)], args=[code, self.max_attempts])
+
+
+class MemoryCodeStore:
+    """in-process stand-in for RedisCodeStore (tests, single worker development)"""
+
+    def __init__(self, ttl: int, max_attempts: int) -> None:
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._codes = {}
+
+    async def issue(self, user_id: int, purpose: str, code: str) -> None:
+        self._codes[(user_id, purpose)] = [code, 0, time.monotonic() + self.ttl]
+
+    async def verify(self, user_id: int, purpose: str, code: str) -> str:
+        entry = self._codes.get((user_id, purpose))
+        if entry is None or entry[2] < time.monotonic():
+            self._codes.pop((user_id, purpose), None)
+            return EXPIRED
+        entry[1] += 1
+        if entry[1] > self.max_attempts:
+            del self._codes[(user_id, purpose)]
+            return LOCKED
+        if entry[0] == code:
+            del self._codes[(user_id, purpose)]
+            return VALID
+        return INVALID
+
+
+if VERIFY_CODE_STORE == 'memory':
+    verification_codes = MemoryCodeStore(VERIFY_CODE_TTL, VERIFY_CODE_MAX_ATTEMPTS)
+else:
+    verification_codes = RedisCodeStore(async_redis_conn, VERIFY_CODE_TTL, VERIFY_CODE_MAX_ATTEMPTS)
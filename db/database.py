@@ -1,54 +1,280 @@
-from typing import AsyncIterator, Generator
+from typing import AsyncIterator, List, Optional, Sequence
+from contextlib import asynccontextmanager, suppress
 from sqlalchemy import create_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from sqlalchemy.orm import declarative_base, sessionmaker
 from decouple import config
 from redis import Redis
+import aioredis
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from starlette.concurrency import run_in_threadpool
 from settings import LOGGER
+import asyncio
+import json
+import csv
+import io
 
 DB_USER = config('POSTGRES_USER')
 DB_PASSWORD = config('POSTGRES_PASSWORD')
 DB_ADDRESS = config('POSTGRES_ADDRESS')
 DB_NAME = config('POSTGRES_DB')
+# True -> asyncpg + AsyncSession, False -> psycopg2 Session driven from the threadpool
+DB_ASYNC = config('DB_ASYNC', default=True, cast=bool)
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+DB_MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=20, cast=int)
+# schema setup belongs to init_db.py, only development setups create tables on worker startup
+DB_CREATE_ALL = config('DB_CREATE_ALL', default=False, cast=bool)
 REDIS_LIMITER = config('REDIS_LIMITER',cast=str)
 REDIS_LIMITER_PORT = config('REDIS_LIMITER_PORT', cast=int)
 REDIS_LIMITER_DB = config('REDIS_LIMITER_DB', cast=int)
-# engine = create_async_engine(
-#     f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}", echo=False, convert_unicode=True
-# )
-engine = create_engine(
-    f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}", echo=False, convert_unicode=True
-)
-engine.execution_options(stream_results=True)
+
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}"
+SYNC_DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}"
+
+if DB_ASYNC:
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+    )
+    SessionLocal = sessionmaker(
+        engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+else:
+    engine = create_engine(
+        SYNC_DATABASE_URL, echo=False, convert_unicode=True, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+    )
+    SessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 redis_conn = Redis(host=REDIS_LIMITER, port=REDIS_LIMITER_PORT, db=REDIS_LIMITER_DB, decode_responses=True)
+async_redis_conn = aioredis.from_url(
+    f"redis://{REDIS_LIMITER}:{REDIS_LIMITER_PORT}/{REDIS_LIMITER_DB}", decode_responses=True)
 
 Base = declarative_base()
 
-SessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+class ThreadedSession:
+    """AsyncSession-compatible facade over a blocking psycopg2 Session.
+
+    Every call that talks to the database runs in the threadpool, so route
+    handlers are written once against the AsyncSession API and the sync engine
+    can still be selected with ``DB_ASYNC=False`` for throughput comparisons.
+    """
+
+    def __init__(self, sync_session):
+        self.sync_session = sync_session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kw):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kw)
+
+    async def scalar(self, statement, params=None, **kw):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kw)
+
+    async def scalars(self, statement, params=None, **kw):
+        result = await self.execute(statement, params, **kw)
+        return result.scalars()
+
+    async def get(self, entity, ident, **kw):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kw)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def flush(self, objects=None):
+        await run_in_threadpool(self.sync_session.flush, objects)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+    async def run_sync(self, fn, *arg, **kw):
+        return await run_in_threadpool(fn, self.sync_session, *arg, **kw)
+
+    async def stream(self, statement, params=None, **kw):
+        """execute on a server-side (named) cursor, like AsyncSession.stream"""
+        result = await self.execute(statement.execution_options(stream_results=True), params, **kw)
+        return ThreadedStreamResult(result)
+
+
+class ThreadedStreamResult:
+    """the streaming part of AsyncResult over a psycopg2 server-side cursor"""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size: int):
+        while True:
+            rows = await run_in_threadpool(self.result.fetchmany, size)
+            if not rows:
+                break
+            yield rows
 
 
 async def init_db():
     # develop mode (not recommend)
     # Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
-    LOGGER.info('init db starting ....')
+    if DB_ASYNC:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    else:
+        await run_in_threadpool(Base.metadata.create_all, bind=engine)
+    LOGGER.info(f'init db starting ({"asyncpg" if DB_ASYNC else "psycopg2"}) ....')
 
-# none async
 
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """session for code running outside a request (startup tasks, workers)"""
+    if DB_ASYNC:
+        async with SessionLocal() as db:
+            yield db
+    else:
+        db = ThreadedSession(SessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
 
-def get_db() -> Generator:
-    db = SessionLocal()
-    try:
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with session_scope() as db:
         yield db
+
+
+def constraint_name(error) -> Optional[str]:
+    """name of the constraint behind an IntegrityError, for both psycopg2 and asyncpg"""
+    orig = getattr(error, 'orig', None)
+    diag = getattr(orig, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name
+    return getattr(getattr(orig, '__cause__', None), 'constraint_name', None)
+
+
+async def copy_records(db, table_name: str, columns: Sequence[str], records: Sequence[tuple]) -> None:
+    """bulk load rows with COPY ... FROM STDIN inside the session's transaction"""
+    if DB_ASYNC:
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            table_name, records=records, columns=list(columns))
+        return
+
+    def copy(session):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(records)
+        buffer.seek(0)
+        cursor = session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    await db.run_sync(copy)
+
+
+class Explain(Executable, ClauseElement):
+    """``EXPLAIN (FORMAT JSON) <statement>`` keeping the statement's bound parameters"""
+    inherit_cache = False
+
+    def __init__(self, statement) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kw)}"
+
+
+async def estimate_rows(db, statement) -> int:
+    """planner estimate of the rows ``statement`` returns, from table statistics instead of COUNT(*)"""
+    plan = (await db.execute(Explain(statement))).scalar()
+    if isinstance(plan, str):
+        # asyncpg hands json columns over undecoded
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def stream_rows(db, statement, batch_size: int) -> AsyncIterator[List]:
+    """rows of ``statement`` in lists of ``batch_size``, read from a server-side cursor
+
+    Only one batch is held in memory at a time, whatever the size of the result.
+    The cursor is closed once it is exhausted, or with the session when the
+    consumer stops early.
+    """
+    result = await db.stream(statement.execution_options(max_row_buffer=batch_size))
+    async for rows in result.partitions(batch_size):
+        yield rows
+
+
+async def copy_csv(db, statement, buffered_chunks: int = 8) -> AsyncIterator[bytes]:
+    """``COPY (statement) TO STDOUT`` as CSV with a header line, chunks as postgres sends them
+
+    Postgres formats the CSV itself, no rows are built in Python. The copy
+    runs in a task (a thread for psycopg2) feeding a bounded queue, so a slow
+    client slows the copy down instead of piling up memory.
+    """
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    queue = asyncio.Queue(maxsize=buffered_chunks)
+    done = object()
+    closed = False
+
+    if DB_ASYNC:
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+
+        async def copy():
+            await raw_connection.driver_connection.copy_from_query(
+                sql, output=queue.put, format="csv", header=True)
+    else:
+        loop = asyncio.get_running_loop()
+
+        class QueueWriter:
+            def write(self, data):
+                if closed:
+                    raise IOError("export cancelled")
+                asyncio.run_coroutine_threadsafe(queue.put(data), loop).result()
+
+        def copy_sync(session):
+            cursor = session.connection().connection.cursor()
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", QueueWriter())
+
+        async def copy():
+            await db.run_sync(copy_sync)
+
+    async def run():
+        try:
+            await copy()
+        finally:
+            await queue.put(done)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            yield chunk if isinstance(chunk, bytes) else chunk.encode()
+        await task
     finally:
-        db.close()
-
-# query with async
-# async def init_db():
-#     async with engine.begin() as session:
-#         await session.run_sync(Base.metadata.create_all)
-# async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-# async def get_db() -> AsyncIterator[AsyncSession]:
-#     async with async_session() as db:
-#         yield db
+        if not task.done():
+            # client went away: stop the copy, cancelling the task does not stop a psycopg2
+            # thread, that one raises on its next write
+            closed = True
+            task.cancel()
+            # the session must not be closed while the copy still uses its connection;
+            # keep draining so a writer blocked on the full queue gets to the closed check
+            while not task.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait({task}, timeout=0.05)
+            with suppress(asyncio.CancelledError, IOError):
+                await task
@@ -1,10 +1,13 @@
 from db import Base
+from db.database import SYNC_DATABASE_URL
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from alembic import context
 config = context.config
 fileConfig(config.config_file_name)
+# migrations always run on the sync driver, whatever DB_ASYNC says
+config.set_main_option("sqlalchemy.url", SYNC_DATABASE_URL)
 target_metadata = Base.metadata
 
 
@@ -0,0 +1,35 @@
+"""users_log (user_id, id) index for keyset pagination
+
+Revision ID: 3f2a9c1d7b64
+Revises: 
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b64'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # users_log is append-only and large, build the index without blocking logins.
+    # IF NOT EXISTS: init_db runs create_all on unversioned databases first, which
+    # already creates the index for a missing table (alembic 1.7 has no if_not_exists)
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_log_user_id_id '
+            'ON users_log (user_id, id)'
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_log_user_id_id', table_name='users_log',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,42 @@
+"""orders (user_id, id) and (order_status, id) indexes for keyset pagination
+
+Revision ID: 8b1e4d2f6a90
+Revises: 3f2a9c1d7b64
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e4d2f6a90'
+down_revision = '3f2a9c1d7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # orders keeps taking writes while the indexes are built; IF NOT EXISTS
+    # because create_all may already have made them (see 3f2a9c1d7b64)
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_user_id_id '
+            'ON orders (user_id, id)'
+        )
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_order_status_id '
+            'ON orders (order_status, id)'
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_orders_order_status_id', table_name='orders',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_orders_user_id_id', table_name='orders',
+            postgresql_concurrently=True,
+        )
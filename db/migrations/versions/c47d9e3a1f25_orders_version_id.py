@@ -0,0 +1,28 @@
+"""orders.version_id for optimistic concurrency (ETag / If-Match)
+
+Revision ID: c47d9e3a1f25
+Revises: 8b1e4d2f6a90
+Create Date: 2026-10-18 20:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47d9e3a1f25'
+down_revision = '8b1e4d2f6a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a constant default does not rewrite the table, existing orders start at version 1;
+    # IF NOT EXISTS because create_all may already have made the column (see 3f2a9c1d7b64)
+    op.execute(
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS version_id INTEGER NOT NULL DEFAULT '1'"
+    )
+
+
+def downgrade():
+    op.drop_column('orders', 'version_id')
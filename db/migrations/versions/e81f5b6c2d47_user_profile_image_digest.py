@@ -0,0 +1,41 @@
+"""user_profile.image_digest, indexed reference to the content store blob
+
+Revision ID: e81f5b6c2d47
+Revises: c47d9e3a1f25
+Create Date: 2026-10-18 21:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81f5b6c2d47'
+down_revision = 'c47d9e3a1f25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS because create_all may already have made them (see 3f2a9c1d7b64)
+    op.execute("ALTER TABLE user_profile ADD COLUMN IF NOT EXISTS image_digest VARCHAR(64)")
+    # media/cas/ab/cd/<sha256>/<rendition>, other images keep NULL
+    op.execute(
+        "UPDATE user_profile SET image_digest = "
+        "substring(image from 'media/cas/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})/') "
+        "WHERE image_digest IS NULL"
+    )
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_profile_image_digest '
+            'ON user_profile (image_digest)'
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_user_profile_image_digest', table_name='user_profile',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('user_profile', 'image_digest')
@@ -4,6 +4,7 @@ from sqlalchemy import (
     Column,
     Integer,
     ForeignKey,
+    Index,
 )
 from sqlalchemy_utils import ChoiceType
 
@@ -21,6 +22,11 @@ class Order(Base):
         ("EXTRA-LARGE", "extra-large"),
     )
     __tablename__ = "orders"
+    __table_args__ = (
+        # keyset pagination: WHERE user_id = ? / order_status = ? AND id < ? ORDER BY id DESC
+        Index("ix_orders_user_id_id", "user_id", "id"),
+        Index("ix_orders_order_status_id", "order_status", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     quantity = Column(Integer, nullable=False)
     order_status = Column(ChoiceType(
@@ -30,6 +36,9 @@ class Order(Base):
     # string name as obj in relationship is Class name
     user_id = Column(Integer, ForeignKey("user.id"))
     user = relationship("User", back_populates='orders')
+    # bumped on every change, sent as the ETag and checked against If-Match
+    version_id = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version_id}
 
     def __repr__(self):
         return f"<Order {self.id}>"
@@ -9,6 +9,7 @@ from sqlalchemy import (
     ForeignKey,
     DateTime,
     JSON,
+    Index,
 )
 from sqlalchemy_utils import ChoiceType, URLType
 import datetime
@@ -46,17 +47,13 @@ class CodeVerification(Base):
     def __repr__(self):
         return f"<code for {self.id}>"
 
-    @staticmethod
-    def old_code_remover(db):
-        old = datetime.datetime.now() - datetime.timedelta(days=1)
-        old_code = db.query(CodeVerification).filter(
-            CodeVerification.expiration_time < old).all()
-        for olds in old_code:
-            db.delete(olds)
-
 
 class UserLog(Base):
     __tablename__ = "users_log"
+    __table_args__ = (
+        # keyset pagination of a user's history: WHERE user_id = ? AND id < ? ORDER BY id DESC
+        Index("ix_users_log_user_id_id", "user_id", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_log = Column(JSON)
     login_datetime = Column(DateTime, default=datetime.datetime.now())
@@ -81,6 +78,8 @@ class UserProfile(Base):
     address = Column(Text)
     image = Column(
         URLType, default="/media/profile_image/simple.png", nullable=False)
+    # content store blob behind image, NULL for files outside the store
+    image_digest = Column(String(64), index=True)
     postal_code = Column(String(25))
     national_code = Column(String(10))
     type = Column(ChoiceType(TYPE), default="guest")
@@ -1,8 +1,10 @@
 from pydantic import BaseModel, EmailStr, validator, Field
-from fastapi import Form, Depends
+from fastapi import Form, Depends, status
+from fastapi.exceptions import HTTPException
 from typing import Optional, Text
 from datetime import timedelta
 from db import AuthHandler
+from db.auth_config.user_status import user_status_cache
 import re
 
 
@@ -22,9 +24,9 @@ class SignUpModel(BaseModel):
     password: str
     password2: Optional[str]
 
-    def hashed_password(self):
-        self.password = AuthHandler.get_password_hash(self.password)
-        self.password2 = AuthHandler.get_password_hash(self.password)
+    async def hashed_password(self):
+        self.password = await AuthHandler.get_password_hash(self.password)
+        self.password2 = self.password
         return self.password
 
     @validator('phone_number')
@@ -65,9 +67,9 @@ class ResetPassword(BaseModel):
     new_password: str 
     new_password2: Optional[str]
 
-    def hashed_password(self):
-        self.new_password = AuthHandler.get_password_hash(self.new_password)
-        self.new_password2 = AuthHandler.get_password_hash(self.new_password)
+    async def hashed_password(self):
+        self.new_password = await AuthHandler.get_password_hash(self.new_password)
+        self.new_password2 = self.new_password
         return self.new_password
 
     @validator('new_password2')
@@ -134,3 +136,46 @@ async def get_current_user(token: str = Depends(AuthHandler.Token_requirement)):
     username = token.get_jwt_subject()
     user = token.get_raw_jwt()[username]
     return user
+
+
+class Principal(BaseModel):
+    id: int
+    username: str
+    email: Optional[str]
+    phone_number: Optional[str]
+    is_active: bool = False
+    is_staff: bool = False
+
+
+async def get_current_principal(token: str = Depends(AuthHandler.Token_requirement)) -> Principal:
+    """authenticated user built from the access token claims, no database access
+
+    Args:
+        token: verified AuthJWT
+
+    Returns:
+        Principal: id, username and flags as they were when the token was issued
+    """
+    username = token.get_jwt_subject()
+    return Principal(username=username, **token.get_raw_jwt()[username])
+
+
+async def get_fresh_principal(principal: Principal = Depends(get_current_principal)) -> Principal:
+    """same as get_current_principal but is_active/is_staff come from the user status cache
+
+    Args:
+        principal: principal from the token claims
+
+    Raises:
+        HTTPException: user does not exist anymore
+
+    Returns:
+        Principal: principal with current flags
+    """
+    state = await user_status_cache.get(principal.id)
+    if state is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User does not exist"
+        )
+    return principal.copy(update=state)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, conlist
 from typing import Optional
 from enum import Enum
 ORDER_SIZES = (
@@ -7,6 +7,8 @@ ORDER_SIZES = (
     ("LARGE", "large"),
     ("EXTRA-LARGE", "extra-large"),
 )
+# upper bound for the /order/bulk endpoints, keeps one statement's parameter list reasonable
+BULK_MAX_ITEMS = 500
 
 
 class status(str, Enum):
@@ -54,3 +56,14 @@ class OrderStatusModel(BaseModel):
 class OrderTest(BaseModel):
     customer_name: str
     order_quantity: int
+
+
+class OrderIdsModel(BaseModel):
+    ids: conlist(int, min_items=1, max_items=BULK_MAX_ITEMS)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "ids": [1, 2, 3]
+            }
+        }
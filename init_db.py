@@ -0,0 +1,50 @@
+"""one-shot schema setup, run once per deploy before the API workers start
+
+An empty database gets the tables from the models and is stamped with the
+latest migration; a database alembic already knows is upgraded to head; an
+existing unversioned database (created by older releases on worker startup)
+gets missing tables and then all migrations, which skip indexes and columns
+create_all already made for those tables. An advisory lock keeps several
+containers starting at once from migrating concurrently. Revocations that
+older releases kept under bare jti keys in redis are moved to the denylist.
+"""
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, text
+from db import Base
+from db.database import SYNC_DATABASE_URL, redis_conn
+from db.auth_config.denylist import migrate_legacy_keys
+from settings import LOGGER
+import os
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+# arbitrary, only has to be the same for every process running this script
+MIGRATION_LOCK = 726_115_001
+
+
+def main() -> None:
+    engine = create_engine(SYNC_DATABASE_URL)
+    alembic_config = Config(ALEMBIC_INI)
+    with engine.connect() as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK})
+        try:
+            tables = set(inspect(engine).get_table_names())
+            if "alembic_version" in tables:
+                command.upgrade(alembic_config, "head")
+                LOGGER.info('init db: migrated to head')
+            elif not tables:
+                Base.metadata.create_all(bind=engine)
+                command.stamp(alembic_config, "head")
+                LOGGER.info('init db: schema created and stamped')
+            else:
+                Base.metadata.create_all(bind=engine)
+                command.upgrade(alembic_config, "head")
+                LOGGER.info('init db: unversioned schema migrated to head')
+            LOGGER.info(f'init db: {migrate_legacy_keys(redis_conn)} legacy revocations moved to the denylist')
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK})
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
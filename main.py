@@ -1,17 +1,24 @@
 from fastapi.responses import JSONResponse
-from fastapi.routing import APIRoute
-from fastapi.openapi.utils import get_openapi
 from fastapi_jwt_auth.exceptions import AuthJWTException
 from fastapi import FastAPI, Request
 from db.schema import auth_schema
 from fastapi_jwt_auth import AuthJWT
-from db import init_db,redis_client
+from db import init_db,password_hasher,token_denylist
+from db.database import DB_CREATE_ALL
+from decouple import config
 from settings import Middleware
 from settings.include_routers import include_router
+from utils import geoip_resolver
+from utils.openapi import setup_openapi, openapi_document
+from utils.audit_log import login_audit
+from utils.mail_service.outbox import mail_outbox, MAIL_WORKER
+from core.uploader.image_pipeline import image_pipeline
+from core.uploader.thumbnails import thumbnail_cache
 
 import uvicorn
-import re
-import inspect
+
+# defer everything that can be done on first use (geoip table, OpenAPI document)
+FAST_STARTUP = config('FAST_STARTUP', default=False, cast=bool)
 
 tags_metadata = [
     {
@@ -33,64 +40,22 @@ tags_metadata = [
 app = FastAPI(
     title="core_api",
     debug=True,
-    openapi_tags=tags_metadata
+    openapi_tags=tags_metadata,
+    # served from the prebuilt document, see utils.openapi
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
 )
+setup_openapi(app)
 
 
-def custom_openapi():
-    if app.openapi_schema:
-        return app.openapi_schema
-
-    openapi_schema = get_openapi(
-        title="Core API",
-        version="1.0",
-        description="An API with an Authorize Button",
-        routes=app.routes,
-    )
-
-    openapi_schema["components"]["securitySchemes"] = {
-        "Bearer Auth": {
-            "type": "apiKey",
-            "in": "header",
-            "name": "Authorization",
-            "description": "Enter: **'Bearer &lt;JWT&gt;'**, where JWT is the access token"
-        }
-    }
-
-    # Get all routes where jwt_optional() or jwt_required
-    api_router = [route for route in app.routes if isinstance(route, APIRoute)]
-
-    for route in api_router:
-        path = getattr(route, "path")
-        endpoint = getattr(route, "endpoint")
-        methods = [method.lower() for method in getattr(route, "methods")]
-
-        for method in methods:
-            # access_token
-            if (
-                re.search("jwt_required", inspect.getsource(endpoint)) or
-                re.search("fresh_jwt_required", inspect.getsource(endpoint)) or
-                re.search("jwt_optional", inspect.getsource(endpoint))
-            ):
-                openapi_schema["paths"][path][method]["security"] = [
-                    {
-                        "Bearer": []
-                    }
-                ]
-
-    app.openapi_schema = openapi_schema
-    return app.openapi_schema
-
-
-app.openapi = custom_openapi
-
 middleware = Middleware(app)
 middleware.cors_origins()
-middleware.staticFiles()
 middleware.allowed_domains()
-middleware.rate_limit()
 
 include_router(app)
+# mounted after the routers, /media/thumb is a route below the /media mount
+middleware.staticFiles()
 
 
 @AuthJWT.load_config
@@ -99,9 +64,7 @@ def get_config():
 
 @AuthJWT.token_in_denylist_loader
 def check_if_token_in_denylist(decrypted_token):
-    jti = decrypted_token['jti']
-    entry = redis_client.get(jti)
-    return entry and entry == 'true'
+    return token_denylist.is_token_revoked(decrypted_token)
 
 @app.exception_handler(AuthJWTException)
 def authjwt_exception_handler(request: Request, exc: AuthJWTException):
@@ -112,14 +75,30 @@ def authjwt_exception_handler(request: Request, exc: AuthJWTException):
 
 @app.on_event("startup")
 async def on_startup():
-    await init_db()
-    await middleware.limiter_conf()
-
+    if DB_CREATE_ALL:
+        await init_db()
+    password_hasher.start()
+    image_pipeline.start()
+    await thumbnail_cache.start()
+    await token_denylist.start()
+    if not FAST_STARTUP:
+        openapi_document.load(app)
+        geoip_resolver.load()
+    await login_audit.start()
+    if MAIL_WORKER:
+        await mail_outbox.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    password_hasher.shutdown()
+    image_pipeline.shutdown()
+    await token_denylist.stop()
+    await login_audit.stop()
+    await mail_outbox.stop()
+    await geoip_resolver.close()
 
 
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, workers=4)
-
-
-# for install fastapi-limiter -> pip install git+https://github.com/long2ice/fastapi-limiter.git
\ No newline at end of file
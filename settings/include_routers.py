@@ -4,6 +4,7 @@ from db.schema import auth_schema
 from core.overview.index import app_view
 from fastapi_jwt_auth import AuthJWT
 from core.uploader import upload_file
+from core.uploader.thumbnails import thumb_router
 from ws.ws import ws
 
 @AuthJWT.load_config
@@ -27,6 +28,9 @@ def include_router(app):
     app.include_router(
         upload_file.file_router,
     )
+    app.include_router(
+        thumb_router,
+    )
     app.include_router(
         app_view,
     )
\ No newline at end of file
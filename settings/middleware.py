@@ -1,18 +1,20 @@
-from .logger import logger as LOGGER
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi_limiter import FastAPILimiter
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from decouple import config
-import aioredis
+from .static_assets import static_assets, AssetStaticFiles
+import os
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """static files whose url changes with their content, cacheable for a year"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
 
 
-limiter = Limiter(key_func=get_remote_address)
 class Middleware:
-    REDIS_LIMITER = config('REDIS_LIMITER')
     ORIGINS = [
         "http://localhost",
         "http://localhost:8080",
@@ -36,19 +38,15 @@ class Middleware:
             allow_credentials=True,
             allow_methods=["*"],
             allow_headers=["*"],
+            # browser clients need the order ETag to send it back as If-Match
+            expose_headers=["ETag"],
         )
 
     def staticFiles(self):
+        # content addressed blobs never change, mounted before /media to add cache headers
+        os.makedirs("media/cas", exist_ok=True)
+        self.app.mount("/media/cas", ImmutableStaticFiles(directory="media/cas"), name="media_cas")
         self.app.mount("/media", StaticFiles(directory="media"), name="media")
+        static_assets.load()
         self.app.mount(
-            "/static", StaticFiles(directory="static"), name="static")
-
-    def rate_limit(self):
-        self.app.state.limiter = limiter
-        self.app.add_exception_handler(
-            RateLimitExceeded, _rate_limit_exceeded_handler)
-        
-    async def limiter_conf(self):
-        rate_limiter = await aioredis.from_url(f"{self.REDIS_LIMITER}", encoding="utf-8", decode_responses=True, db=2)
-        await FastAPILimiter.init(prefix="core_api",redis=rate_limiter)
-        LOGGER.info('rate limit activated...')
\ No newline at end of file
+            "/static", AssetStaticFiles(static_assets), name="static")
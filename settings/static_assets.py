@@ -0,0 +1,199 @@
+from mimetypes import guess_type
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from fastapi.staticfiles import StaticFiles
+from decouple import config
+from .logger import logger as LOGGER
+import hashlib
+import gzip
+import json
+import sys
+import os
+
+try:
+    import brotli
+except ImportError:  # optional, gzip variants only
+    brotli = None
+try:
+    import fcntl
+except ImportError:  # windows, workers build unlocked
+    fcntl = None
+
+STATIC_DIR = "static"
+STATIC_BUILD_DIR = config('STATIC_BUILD_DIR', default='.static_build')
+MANIFEST = "manifest.json"
+BUILD_LOCK = ".lock"
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE_TYPES = {"application/javascript", "application/json", "application/xml", "image/svg+xml"}
+# Content-Encoding token and variant suffix, preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _compressible(path: str) -> bool:
+    media_type = guess_type(path)[0] or ""
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+def accepted_encodings(header: str) -> set:
+    """codings of an Accept-Encoding header, without the ones refused with q=0"""
+    accepted = set()
+    for token in header.split(","):
+        coding, *parameters = (part.strip() for part in token.split(";"))
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+def _write(path: str, data: bytes) -> None:
+    """write through a temporary name, readers see the old file or the complete new one"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as target:
+        target.write(data)
+    os.replace(temporary, path)
+
+
+def build_assets(source: str, out: str) -> dict:
+    """copy ``source`` to ``out`` under content hashed names, with .gz/.br next to text assets
+
+    ``css/main.css`` becomes ``css/main.3b5d5c3712.css``; a compressed variant
+    is only kept when it saves at least 10%. The manifest maps logical to
+    fingerprinted paths and is written last, so a half finished build is
+    never picked up; every file is written to a temporary name and renamed.
+    The Docker image runs it at build time with
+    ``python -m settings.static_assets build``.
+    """
+    files = {}
+    for root, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(root, name)
+            logical = os.path.relpath(path, source).replace(os.sep, "/")
+            with open(path, "rb") as asset:
+                data = asset.read()
+            stem, extension = os.path.splitext(logical)
+            fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{extension}"
+            target = os.path.join(out, fingerprinted)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                # variants first, the fingerprinted file marks the asset as done
+                if _compressible(logical):
+                    variants = {".gz": gzip.compress(data, 9, mtime=0)}
+                    if brotli is not None:
+                        variants[".br"] = brotli.compress(data, quality=11)
+                    for suffix, compressed in variants.items():
+                        if len(compressed) < len(data) * 0.9:
+                            _write(target + suffix, compressed)
+                _write(target, data)
+            files[logical] = fingerprinted
+    temporary = os.path.join(out, f"{MANIFEST}.{os.getpid()}")
+    with open(temporary, "w") as manifest:
+        json.dump(files, manifest, indent=1, sort_keys=True)
+    os.replace(temporary, os.path.join(out, MANIFEST))
+    return files
+
+
+class StaticAssets:
+    """fingerprinted view of static/, built at startup when the build is missing or stale"""
+
+    def __init__(self, source: str, out: str) -> None:
+        self.source = source
+        self.out = out
+        self.files = {}
+        self.fingerprinted = {}
+        self.variants = {}
+
+    def _stale(self) -> bool:
+        manifest = os.path.join(self.out, MANIFEST)
+        if not os.path.exists(manifest):
+            return True
+        built = os.stat(manifest).st_mtime
+        return any(
+            os.stat(os.path.join(root, name)).st_mtime > built
+            for root, _, names in os.walk(self.source) for name in names
+        )
+
+    def _build(self) -> None:
+        """build under an exclusive lock, workers starting together build once"""
+        os.makedirs(self.out, exist_ok=True)
+        with open(os.path.join(self.out, BUILD_LOCK), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # another worker may have built while this one waited
+            if self._stale():
+                build_assets(self.source, self.out)
+                LOGGER.info(f'static assets built into {self.out}')
+
+    def load(self) -> None:
+        if self._stale():
+            self._build()
+        with open(os.path.join(self.out, MANIFEST)) as manifest:
+            self.files = json.load(manifest)
+        self.fingerprinted = {value: key for key, value in self.files.items()}
+        self.variants = {
+            name: {suffix for _, suffix in ENCODINGS if os.path.exists(os.path.join(self.out, name + suffix))}
+            for name in self.fingerprinted
+        }
+
+    def url(self, path: str) -> str:
+        """``/static/<fingerprinted path>``, the plain path for files outside the build"""
+        return f"/static/{self.files.get(path, path)}"
+
+
+static_assets = StaticAssets(STATIC_DIR, STATIC_BUILD_DIR)
+
+
+class AssetStaticFiles(StaticFiles):
+    """/static: fingerprinted names get the best precompressed variant and immutable caching
+
+    Anything else falls through to the plain StaticFiles behaviour on static/.
+    """
+
+    def __init__(self, assets: StaticAssets, **kwargs) -> None:
+        super().__init__(directory=assets.source, **kwargs)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope) -> Response:
+        logical_path = path.replace(os.sep, "/")
+        if logical_path not in self.assets.fingerprinted or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        full_path = os.path.join(self.assets.out, logical_path)
+        encoding, tag = None, logical_path
+        for candidate, suffix in ENCODINGS:
+            if candidate in accepted and suffix in self.assets.variants[logical_path]:
+                encoding, full_path, tag = candidate, full_path + suffix, logical_path + suffix
+                break
+        headers = {
+            "cache-control": IMMUTABLE,
+            "etag": f'"{tag}"',
+            "vary": "accept-encoding",
+        }
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+        if request_headers.get("if-none-match") == headers["etag"]:
+            return Response(status_code=304, headers=headers)
+        try:
+            stat_result = await run_in_threadpool(os.stat, full_path)
+        except FileNotFoundError:
+            return Response("Not Found", status_code=404)
+        response = FileResponse(
+            full_path, headers=headers, method=scope["method"], stat_result=stat_result,
+            media_type=guess_type(logical_path)[0] or "text/plain")
+        # FileResponse sets a weak mtime based etag, the name already is the content hash
+        response.headers["etag"] = headers["etag"]
+        return response
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "build":
+        sys.exit("usage: python -m settings.static_assets build")
+    print(f"{len(build_assets(STATIC_DIR, STATIC_BUILD_DIR))} assets written to {STATIC_BUILD_DIR}")
@@ -1,2 +1,2 @@
 from utils.cbv import CBV
-from utils.geoiplocation import GeoIpLocation
+from utils.geoiplocation import GeoIpLocation, geoip_resolver
@@ -0,0 +1,117 @@
+from sqlalchemy import insert
+from decouple import config
+from settings import LOGGER
+from db import session_scope, UserLog
+from utils.geoiplocation import GeoIpLocation
+import asyncio
+import datetime
+
+AUDIT_QUEUE_SIZE = config('AUDIT_QUEUE_SIZE', default=10_000, cast=int)
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', default=500, cast=int)
+AUDIT_FLUSH_INTERVAL = config('AUDIT_FLUSH_INTERVAL', default=2.0, cast=float)
+
+
+class LoginAuditLog:
+    """Write-behind pipeline for ``users_log`` rows.
+
+    ``record`` only puts a small tuple on a bounded queue; a background task
+    enriches the events with GeoIP data and bulk inserts them once
+    ``batch_size`` events are waiting or ``flush_interval`` seconds passed.
+    When the queue is full new events are dropped and counted, login never
+    waits on the audit log.
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float) -> None:
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+        self._queue = None
+        self._task = None
+        self._stopping = False
+
+    def record(self, user_id: int, ip: str) -> bool:
+        if self._queue is None or self._stopping:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((user_id, ip, datetime.datetime.now()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _next_batch(self) -> list:
+        """up to batch_size events, ends early on the flush deadline or the stop marker (None)"""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def flush(self, batch: list) -> None:
+        if not batch:
+            return
+        locations = {ip: await GeoIpLocation(ip) for ip in {ip for _, ip, _ in batch}}
+        rows = [
+            {"user_id": user_id, "user_log": locations[ip], "login_datetime": login_datetime}
+            for user_id, ip, login_datetime in batch
+        ]
+        try:
+            async with session_scope() as db:
+                await db.execute(insert(UserLog), rows)
+                await db.commit()
+            self.flushed += len(rows)
+        except Exception as e:
+            self.failed += len(rows)
+            LOGGER.error(f'login audit flush of {len(rows)} rows failed: {e}')
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            await self.flush([event for event in batch if event is not None])
+            if batch[-1] is None:
+                return
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """flush everything still queued, then stop the flusher"""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        LOGGER.info(f'login audit log stopped {self.stats()}')
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+login_audit = LoginAuditLog(
+    maxsize=AUDIT_QUEUE_SIZE,
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_INTERVAL,
+)
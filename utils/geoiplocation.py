@@ -1,12 +1,201 @@
-import requests
-from fastapi import APIRouter, status, Depends, Body, Request
-from fastapi.encoders import jsonable_encoder
-from fastapi.exceptions import HTTPException
-API_KEY = "25fa38601f534479b20317050ebe6f1c"
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from decouple import config
+from settings import LOGGER
+import ipaddress
+import struct
+import mmap
+import json
+import csv
+import sys
+import os
+
+GEOIP_DATABASE = config('GEOIP_DATABASE', default='geoip.bin')
+GEOIP_CACHE_SIZE = config('GEOIP_CACHE_SIZE', default=4096, cast=int)
+GEOIP_REMOTE_FALLBACK = config('GEOIP_REMOTE_FALLBACK', default=False, cast=bool)
+GEOIP_REMOTE_TIMEOUT = config('GEOIP_REMOTE_TIMEOUT', default=0.5, cast=float)
+GEOIP_REMOTE_URL = "http://ip-api.com/json/{ip}"
+
+MAGIC = b"GEOIP\x00\x01\x00"
+HEADER = struct.Struct("<8sII")  # magic, ranges, records
+FIELDS = ("countryCode", "country", "regionName", "city", "lat", "lon")
+
+
+def _uint32_array(values):
+    data = array('I', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+
+def _ip_to_int(value: str) -> int:
+    return int(value) if value.isdigit() else int(ipaddress.IPv4Address(value))
+
+
+def build_database(csv_path: str, out_path: str) -> int:
+    """convert a range CSV into the sorted binary file loaded by ``RangeDatabase``
+
+    CSV rows are ``start_ip,end_ip,countryCode,country,regionName,city,lat,lon``,
+    run it with ``python -m utils.geoiplocation build ip_ranges.csv geoip.bin``.
+    Layout after the header: starts[n], ends[n], record_index[n] as uint32,
+    record_offsets[m + 1] as uint32 and then the JSON encoded records. Equal
+    records are stored once.
+    """
+    ranges, records, record_ids = [], [], {}
+    with open(csv_path, newline="") as source:
+        for row in csv.reader(source):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                start, end = _ip_to_int(row[0]), _ip_to_int(row[1])
+            except ValueError:
+                continue  # header line or IPv6 range
+            record = dict(zip(FIELDS, row[2:]))
+            for key in ("lat", "lon"):
+                if record.get(key):
+                    record[key] = float(record[key])
+            blob = json.dumps(record, separators=(",", ":")).encode()
+            if blob not in record_ids:
+                record_ids[blob] = len(records)
+                records.append(blob)
+            ranges.append((start, end, record_ids[blob]))
+    ranges.sort()
+    offsets, position = [], 0
+    for blob in records:
+        offsets.append(position)
+        position += len(blob)
+    offsets.append(position)
+    with open(out_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(ranges), len(records)))
+        for column in range(3):
+            _uint32_array(item[column] for item in ranges).tofile(out)
+        _uint32_array(offsets).tofile(out)
+        for blob in records:
+            out.write(blob)
+    return len(ranges)
+
+
+class RangeDatabase:
+    """read-only, mmap backed view of a file written by ``build_database``"""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as source:
+            self._mmap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, record_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a geoip database")
+        view = memoryview(self._mmap)
+        position = HEADER.size
+        columns = []
+        for length in (count, count, count, record_count + 1):
+            column = view[position:position + length * 4].cast('I')
+            if sys.byteorder == 'big':
+                column = _uint32_array(column)
+            columns.append(column)
+            position += length * 4
+        self.starts, self.ends, self.record_index, self.offsets = columns
+        self._records = position
+        self.count = count
+
+    def lookup(self, ip: int):
+        position = bisect_right(self.starts, ip) - 1
+        if position < 0 or self.ends[position] < ip:
+            return None
+        record = self.record_index[position]
+        start, end = self.offsets[record], self.offsets[record + 1]
+        return json.loads(self._mmap[self._records + start:self._records + end])
+
+
+class GeoIpResolver:
+    """local range database first, ip-api.com only as a bounded fallback"""
+
+    def __init__(self, database_path: str, cache_size: int, remote_fallback: bool, remote_timeout: float) -> None:
+        self.database_path = database_path
+        self.cache_size = cache_size
+        self.remote_fallback = remote_fallback
+        self.remote_timeout = remote_timeout
+        self._database = None
+        self._loaded = False
+        self._cache = OrderedDict()
+        self._client = None
+
+    def load(self) -> None:
+        self._loaded = True
+        if os.path.exists(self.database_path):
+            self._database = RangeDatabase(self.database_path)
+            LOGGER.info(f'geoip database loaded ({self._database.count} ranges)')
+        else:
+            LOGGER.warning(f'geoip database {self.database_path} not found')
+
+    @property
+    def database(self):
+        if not self._loaded:
+            self.load()
+        return self._database
+
+    def _remember(self, ip: str, result: dict) -> dict:
+        self._cache[ip] = result
+        self._cache.move_to_end(ip)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def lookup_local(self, ip: str) -> dict:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return {"status": "fail", "message": "invalid query", "query": ip}
+        if address.is_private or address.is_loopback or address.is_reserved:
+            return {"status": "fail", "message": "private range", "query": ip}
+        if address.version == 4 and self.database is not None:
+            record = self.database.lookup(int(address))
+            if record is not None:
+                return {"status": "success", **record, "query": ip}
+        return {"status": "fail", "message": "unknown", "query": ip}
+
+    async def _lookup_remote(self, ip: str) -> dict:
+        import httpx
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.remote_timeout)
+        try:
+            response = await self._client.get(GEOIP_REMOTE_URL.format(ip=ip))
+            return response.json()
+        except Exception as e:
+            LOGGER.error(f'geoip remote lookup failed: {e}')
+            return None
+
+    async def resolve(self, ip: str) -> dict:
+        cached = self._cache.get(ip)
+        if cached is not None:
+            self._cache.move_to_end(ip)
+            return cached
+        result = self.lookup_local(ip)
+        if result["status"] == "fail" and result["message"] == "unknown" and self.remote_fallback:
+            remote = await self._lookup_remote(ip)
+            if remote:
+                result = remote
+        return self._remember(ip, result)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+geoip_resolver = GeoIpResolver(
+    database_path=GEOIP_DATABASE,
+    cache_size=GEOIP_CACHE_SIZE,
+    remote_fallback=GEOIP_REMOTE_FALLBACK,
+    remote_timeout=GEOIP_REMOTE_TIMEOUT,
+)
+
 
 async def GeoIpLocation(ip):
-    url = f"http://ip-api.com/json/{ip}"
-    response = requests.get(url).json()
-    if not response:
-        return False
-    return response
+    return await geoip_resolver.resolve(ip)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        sys.exit("usage: python -m utils.geoiplocation build <ranges.csv> <geoip.bin>")
+    print(f"{build_database(sys.argv[2], sys.argv[3])} ranges written to {sys.argv[3]}")
@@ -0,0 +1,313 @@
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
+from pathlib import Path
+from typing import List, Optional
+from decouple import config
+from settings import LOGGER
+from db.database import async_redis_conn
+import aiosmtplib
+import asyncio
+import socket
+import json
+import time
+import os
+
+MAIL_SERVER = config('MAIL_SERVER', default='smtp.gmail.com')
+MAIL_PORT = config('MAIL_PORT', default=587, cast=int)
+MAIL_TLS = config('MAIL_TLS', default=True, cast=bool)
+MAIL_SSL = config('MAIL_SSL', default=False, cast=bool)
+MAIL_USERNAME = config('MAIL_USERNAME', default='')
+MAIL_PASSWORD = config('MAIL_PASSWORD', default='')
+MAIL_FROM = config('MAIL_FROM', default='')
+MAIL_FROM_NAME = config('MAIL_FROM_NAME', default='')
+MAIL_WORKER = config('MAIL_WORKER', default=True, cast=bool)
+MAIL_POOL_SIZE = config('MAIL_POOL_SIZE', default=2, cast=int)
+MAIL_BATCH_SIZE = config('MAIL_BATCH_SIZE', default=50, cast=int)
+MAIL_MAX_ATTEMPTS = config('MAIL_MAX_ATTEMPTS', default=5, cast=int)
+MAIL_RETRY_BASE = config('MAIL_RETRY_BASE', default=5.0, cast=float)
+MAIL_IDLE_TIMEOUT = config('MAIL_IDLE_TIMEOUT', default=60.0, cast=float)
+MAIL_OUTBOX_MAXLEN = config('MAIL_OUTBOX_MAXLEN', default=100_000, cast=int)
+# entries pending longer than this belong to a dead worker and are claimed by a live one
+MAIL_CLAIM_IDLE = config('MAIL_CLAIM_IDLE', default=300.0, cast=float)
+
+OUTBOX_STREAM = "mail:outbox"
+RETRY_KEY = "mail:retry"
+DEAD_STREAM = "mail:dead"
+CONSUMER_GROUP = "mailers"
+TEMPLATE_FOLDER = Path(__file__).parent / 'templates'
+
+# move due retries back to the stream, ZREM first so only one worker re-queues a message
+REQUEUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, message in ipairs(due) do
+    if redis.call('ZREM', KEYS[1], message) == 1 then
+        redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'message', message)
+    end
+end
+return #due
+"""
+
+_templates = None
+
+
+def templates():
+    """the Jinja environment, created on first use so jinja2 is not imported by every worker"""
+    global _templates
+    if _templates is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+        _templates = Environment(
+            loader=FileSystemLoader(str(TEMPLATE_FOLDER)),
+            autoescape=select_autoescape(['html']),
+            auto_reload=False,
+        )
+    return _templates
+
+
+def render(template: str, body: dict) -> str:
+    """templates are compiled once per process and kept by the environment"""
+    return templates().get_template(template).render(**body)
+
+
+class SMTPPool:
+    """a few long lived SMTP sessions, each one sends a whole batch of messages
+
+    Sessions are opened lazily, dropped after ``idle_timeout`` seconds without
+    use and reconnected once when the server closed them in between.
+    """
+
+    def __init__(self, size: int, idle_timeout: float) -> None:
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = None
+
+    def _connection(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(
+            hostname=MAIL_SERVER, port=MAIL_PORT, use_tls=MAIL_SSL, start_tls=MAIL_TLS,
+            username=MAIL_USERNAME or None, password=MAIL_PASSWORD or None,
+        )
+
+    async def acquire(self) -> aiosmtplib.SMTP:
+        if self._idle is None:
+            self._idle = asyncio.LifoQueue()
+            for _ in range(self.size):
+                self._idle.put_nowait((None, 0.0))
+        smtp, last_used = await self._idle.get()
+        if smtp is not None and time.monotonic() - last_used > self.idle_timeout:
+            await self._close(smtp)
+            smtp = None
+        if smtp is None:
+            smtp = self._connection()
+        if not smtp.is_connected:
+            try:
+                await smtp.connect()
+            except BaseException:
+                self._idle.put_nowait((None, 0.0))
+                raise
+        return smtp
+
+    def release(self, smtp: Optional[aiosmtplib.SMTP]) -> None:
+        self._idle.put_nowait((smtp, time.monotonic()) if smtp is not None and smtp.is_connected else (None, 0.0))
+
+    @staticmethod
+    async def _close(smtp: aiosmtplib.SMTP) -> None:
+        try:
+            await asyncio.wait_for(smtp.quit(), 5)
+        except Exception:
+            smtp.close()
+
+    async def close(self) -> None:
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            smtp, _ = self._idle.get_nowait()
+            if smtp is not None:
+                await self._close(smtp)
+        self._idle = None
+
+
+def _fields(fields) -> dict:
+    """stream entry fields as a dict, raw replies are a flat name, value list"""
+    return fields if isinstance(fields, dict) else dict(zip(fields[::2], fields[1::2]))
+
+
+class MailOutbox:
+    """Redis stream outbox for outgoing mail.
+
+    ``enqueue`` is a single XADD, request handlers never wait for SMTP. Every
+    worker process with MAIL_WORKER enabled joins the ``mailers`` consumer
+    group, reads up to ``batch_size`` messages at a time and shares them out
+    over the pooled SMTP sessions. Failed messages are retried with exponential
+    backoff through a sorted set and end up in ``mail:dead`` after
+    ``max_attempts``.
+    """
+
+    def __init__(self, redis, pool: SMTPPool, batch_size: int, max_attempts: int, retry_base: float) -> None:
+        self.redis = redis
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.claimed = 0
+        self._requeue = None
+        self._tasks = []
+        self._next_claim = 0.0
+
+    async def enqueue(self, subject: str, recipients: List[str], body: dict,
+                      template: str = "email_template.html") -> str:
+        message = {"subject": subject, "recipients": list(recipients), "body": body,
+                   "template": template, "attempts": 0}
+        return await self.redis.xadd(
+            OUTBOX_STREAM, {"message": json.dumps(message)}, maxlen=MAIL_OUTBOX_MAXLEN, approximate=True)
+
+    @staticmethod
+    def build(message: dict) -> EmailMessage:
+        email = EmailMessage()
+        email["Subject"] = message["subject"] or ""
+        email["From"] = formataddr((MAIL_FROM_NAME, MAIL_FROM)) if MAIL_FROM_NAME else MAIL_FROM
+        email["To"] = ", ".join(message["recipients"])
+        email["Message-ID"] = make_msgid()
+        email.set_content(render(message["template"], message["body"]), subtype="html")
+        return email
+
+    async def _send_batch(self, entries: list) -> None:
+        """send on one session; returns after every entry was acked, retried or dead lettered"""
+        smtp = None
+        try:
+            smtp = await self.pool.acquire()
+        except Exception as e:
+            LOGGER.error(f'mail outbox: smtp connect failed: {e}')
+        for entry_id, message in entries:
+            try:
+                if smtp is None:
+                    raise aiosmtplib.SMTPServerDisconnected("no smtp connection")
+                try:
+                    await smtp.send_message(self.build(message))
+                except aiosmtplib.SMTPServerDisconnected:
+                    # the pooled session was closed by the server, reconnect once
+                    smtp.close()
+                    await smtp.connect()
+                    await smtp.send_message(self.build(message))
+                self.sent += 1
+            except Exception as e:
+                await self._retry(message, e)
+            await self.redis.xack(OUTBOX_STREAM, CONSUMER_GROUP, entry_id)
+        if smtp is not None:
+            self.pool.release(smtp)
+
+    async def _retry(self, message: dict, error: Exception) -> None:
+        message["attempts"] += 1
+        if message["attempts"] >= self.max_attempts:
+            self.dead += 1
+            LOGGER.error(f'mail outbox: giving up on {message["recipients"]}: {error}')
+            message["error"] = str(error)
+            await self.redis.xadd(DEAD_STREAM, {"message": json.dumps(message)},
+                                  maxlen=MAIL_OUTBOX_MAXLEN, approximate=True)
+            return
+        self.retried += 1
+        delay = self.retry_base * 2 ** (message["attempts"] - 1)
+        await self.redis.zadd(RETRY_KEY, {json.dumps(message): time.time() + delay})
+
+    async def _read(self, start: str, block: Optional[int]) -> list:
+        response = await self.redis.xreadgroup(
+            CONSUMER_GROUP, self.consumer, {OUTBOX_STREAM: start}, count=self.batch_size, block=block)
+        return [(entry_id, json.loads(fields["message"])) for _, entries in response or () for entry_id, fields in entries]
+
+    async def _reclaim(self) -> list:
+        """take over entries left unacked by crashed or restarted workers
+
+        Consumer names contain the pid, so a restarted worker never sees its
+        old pending entries again. XAUTOCLAIM moves every entry idle for
+        MAIL_CLAIM_IDLE to this consumer, whoever read it first. Consumers
+        with nothing pending that have been idle as long are removed from
+        the group afterwards; a live one is re-created by its next read.
+        """
+        entries, start = [], "0-0"
+        min_idle = int(MAIL_CLAIM_IDLE * 1000)
+        while len(entries) < self.batch_size:
+            # aioredis 2.0 has no xautoclaim helper
+            response = await self.redis.execute_command(
+                "XAUTOCLAIM", OUTBOX_STREAM, CONSUMER_GROUP, self.consumer, min_idle, start,
+                "COUNT", self.batch_size - len(entries))
+            start, claimed = response[0], response[1]
+            # entries trimmed from the stream come back empty, XAUTOCLAIM already dropped them
+            entries += [(entry_id, json.loads(_fields(fields)["message"])) for entry_id, fields in claimed if fields]
+            if start == "0-0":
+                break
+        for consumer in await self.redis.xinfo_consumers(OUTBOX_STREAM, CONSUMER_GROUP):
+            if consumer["name"] != self.consumer and not consumer["pending"] and consumer["idle"] >= min_idle:
+                await self.redis.xgroup_delconsumer(OUTBOX_STREAM, CONSUMER_GROUP, consumer["name"])
+        if entries:
+            self.claimed += len(entries)
+            LOGGER.warning(f'mail outbox: claimed {len(entries)} entries of dead workers')
+        return entries
+
+    async def _consume(self) -> None:
+        while True:
+            try:
+                entries = []
+                if time.monotonic() >= self._next_claim:
+                    self._next_claim = time.monotonic() + MAIL_CLAIM_IDLE / 2
+                    entries = await self._reclaim()
+                    if len(entries) == self.batch_size:
+                        # more may be waiting, claim again on the next cycle
+                        self._next_claim = 0.0
+                if not entries:
+                    entries = await self._read(">", 1000)
+                if entries:
+                    # one share of the batch per pooled session
+                    sessions = min(self.pool.size, len(entries))
+                    await asyncio.gather(*(self._send_batch(entries[i::sessions]) for i in range(sessions)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f'mail outbox: {e}')
+                await asyncio.sleep(1)
+
+    async def _requeue_due(self) -> None:
+        if self._requeue is None:
+            self._requeue = self.redis.register_script(REQUEUE_SCRIPT)
+        while True:
+            try:
+                await self._requeue(keys=[RETRY_KEY, OUTBOX_STREAM],
+                                    args=[time.time(), self.batch_size, MAIL_OUTBOX_MAXLEN])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f'mail outbox retry: {e}')
+            await asyncio.sleep(1)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        environment = templates()
+        compiled = [environment.get_template(name) for name in environment.list_templates()]
+        try:
+            await self.redis.xgroup_create(OUTBOX_STREAM, CONSUMER_GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._tasks = [asyncio.create_task(self._consume()), asyncio.create_task(self._requeue_due())]
+        LOGGER.info(f'mail outbox worker started ({len(compiled)} templates compiled)')
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.pool.close()
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retried": self.retried, "dead": self.dead, "claimed": self.claimed}
+
+
+mail_outbox = MailOutbox(
+    async_redis_conn,
+    SMTPPool(MAIL_POOL_SIZE, MAIL_IDLE_TIMEOUT),
+    batch_size=MAIL_BATCH_SIZE,
+    max_attempts=MAIL_MAX_ATTEMPTS,
+    retry_base=MAIL_RETRY_BASE,
+)
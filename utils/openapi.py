@@ -0,0 +1,168 @@
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.dependencies.models import Dependant
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
+from fastapi.openapi.utils import get_openapi
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from decouple import config
+from settings import LOGGER
+import fastapi
+import pydantic
+import hashlib
+import json
+import sys
+import os
+
+OPENAPI_FILE = config('OPENAPI_FILE', default='')
+OPENAPI_URL = "/openapi.json"
+SECURITY_SCHEME = "Bearer Auth"
+# info field holding the hash of the sources a document was generated from
+SOURCE_HASH = "x-source-hash"
+SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECURITY_SCHEMES = {
+    SECURITY_SCHEME: {
+        "type": "apiKey",
+        "in": "header",
+        "name": "Authorization",
+        "description": "Enter: **'Bearer &lt;JWT&gt;'**, where JWT is the access token"
+    }
+}
+
+
+def requires_jwt(dependency):
+    """mark a dependency as needing a bearer token, every route depending on it gets the security requirement"""
+    dependency.openapi_security = [{SECURITY_SCHEME: []}]
+    return dependency
+
+
+def route_security(dependant: Dependant) -> Optional[list]:
+    for dependency in dependant.dependencies:
+        security = getattr(dependency.call, "openapi_security", None) or route_security(dependency)
+        if security:
+            return security
+    return None
+
+
+def source_hash(root: str = SOURCE_ROOT) -> str:
+    """sha256 of the project's python files and the fastapi/pydantic versions
+
+    Migrations, hidden directories and virtualenvs are left out, they do
+    not change the document.
+    """
+    digest = hashlib.sha256(f"fastapi {fastapi.__version__} pydantic {pydantic.VERSION}".encode())
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = sorted(
+            name for name in subdirectories
+            if not name.startswith((".", "__")) and name != "migrations"
+            and not os.path.exists(os.path.join(directory, name, "pyvenv.cfg")))
+        for name in sorted(names):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode() + b"\0")
+                with open(path, "rb") as source:
+                    digest.update(source.read())
+    return digest.hexdigest()
+
+
+def build_openapi(app: FastAPI) -> dict:
+    schema = get_openapi(
+        title="Core API",
+        version="1.0",
+        description="An API with an Authorize Button",
+        routes=app.routes,
+    )
+    schema.setdefault("components", {})["securitySchemes"] = SECURITY_SCHEMES
+    schema["info"][SOURCE_HASH] = source_hash()
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or not route.include_in_schema:
+            continue
+        security = route_security(route.dependant)
+        if security:
+            for method in route.methods:
+                operation = schema["paths"].get(route.path_format, {}).get(method.lower())
+                if operation is not None:
+                    operation["security"] = security
+    return schema
+
+
+class OpenApiDocument:
+    """the OpenAPI document of an app, generated once and kept as serialised bytes
+
+    With OPENAPI_FILE pointing at a file written by
+    ``python -m utils.openapi build <file>`` workers load that instead of
+    walking the routes themselves, as long as it was built from the same
+    sources; a stale file is ignored and the document generated.
+    """
+
+    def __init__(self, path: str = "") -> None:
+        self.path = path
+        self.body = None
+        self.etag = None
+        self._schema = None
+
+    def load(self, app: FastAPI) -> None:
+        self.body = self._schema = None
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "rb") as document:
+                body = document.read()
+            schema = json.loads(body)
+            if schema.get("info", {}).get(SOURCE_HASH) == source_hash():
+                self.body, self._schema = body, schema
+                LOGGER.info(f'openapi document loaded from {self.path}')
+            else:
+                LOGGER.warning(f'openapi document {self.path} is stale, generating it from the routes')
+        if self.body is None:
+            self._schema = build_openapi(app)
+            self.body = json.dumps(self._schema, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def schema(self, app: FastAPI) -> dict:
+        if self.body is None:
+            self.load(app)
+        if self._schema is None:
+            self._schema = json.loads(self.body)
+        return self._schema
+
+    def response(self, app: FastAPI, request: Request) -> Response:
+        if self.body is None:
+            self.load(app)
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+openapi_document = OpenApiDocument(OPENAPI_FILE)
+
+
+def setup_openapi(app: FastAPI) -> None:
+    """serve /openapi.json, /docs and /redoc from ``openapi_document``
+
+    The app has to be created with ``openapi_url=None`` so FastAPI does not
+    register its own routes, they would generate the document again.
+    """
+    app.openapi = lambda: openapi_document.schema(app)
+
+    @app.get(OPENAPI_URL, include_in_schema=False)
+    async def openapi(request: Request) -> Response:
+        return openapi_document.response(app, request)
+
+    @app.get("/docs", include_in_schema=False)
+    async def swagger_ui() -> Response:
+        return get_swagger_ui_html(openapi_url=OPENAPI_URL, title=f"{app.title} - Swagger UI")
+
+    @app.get("/redoc", include_in_schema=False)
+    async def redoc() -> Response:
+        return get_redoc_html(openapi_url=OPENAPI_URL, title=f"{app.title} - ReDoc")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "build":
+        sys.exit("usage: python -m utils.openapi build <openapi.json>")
+    from main import app
+    openapi_document.path = ""
+    openapi_document.load(app)
+    with open(sys.argv[2], "wb") as out:
+        out.write(openapi_document.body)
+    print(f"openapi document written to {sys.argv[2]} ({len(openapi_document.body)} bytes)")
@@ -0,0 +1,183 @@
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+import hashlib
+import secrets
+import os
+
+CHUNK_SIZE = 256 * 1024
+# more ranges than this are answered with the whole file
+MAX_RANGES = 16
+ZEROCOPY = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """byte ranges of a ``Range`` header as sorted, merged, inclusive (start, end) pairs
+
+    Handles ``a-b``, open-ended ``a-`` and suffix ``-n`` specs. Returns None
+    when the header is absent or malformed (serve the whole file) and raises
+    RangeNotSatisfiable when no spec overlaps the file.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    ranges = []
+    for spec in header[6:].split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start, end = int(first), int(last) if last else None
+            else:
+                start, end = max(size - int(last), 0), None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+class RangeFileResponse(Response):
+    """file response answering Range requests without loading the file into memory
+
+    Single ranges are sent as 206 with Content-Range, several as
+    ``multipart/byteranges``. ``If-Range`` only allows a partial response when
+    the ETag or Last-Modified still matches. File bytes go out through the
+    server's ``zerocopysend`` extension (sendfile) when it offers one and in
+    ``chunk_size`` pread()s otherwise. With ``accel_redirect`` set the body is
+    left to nginx via X-Accel-Redirect and Python does not touch the file.
+    """
+
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, path: str, request_headers: Headers, media_type: str = None,
+                 method: str = "GET", accel_redirect: str = None) -> None:
+        self.path = path
+        self.request_headers = request_headers
+        self.media_type = media_type or guess_type(path)[0] or "application/octet-stream"
+        self.send_header_only = method.upper() == "HEAD"
+        self.accel_redirect = accel_redirect
+        self.background = None
+        self.status_code = 200
+        self.init_headers({})
+
+    def _validators(self, stat_result: os.stat_result) -> None:
+        etag = hashlib.md5(f"{stat_result.st_mtime}-{stat_result.st_size}".encode()).hexdigest()
+        self.headers["etag"] = f'"{etag}"'
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["accept-ranges"] = "bytes"
+
+    def _if_range_matches(self, stat_result: os.stat_result) -> bool:
+        if_range = self.request_headers.get("if-range")
+        if if_range is None:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == self.headers["etag"]
+        try:
+            return int(parsedate_to_datetime(if_range).timestamp()) >= int(stat_result.st_mtime)
+        except (TypeError, ValueError):
+            return False
+
+    async def _start(self, send: Send, status_code: int) -> None:
+        self.status_code = status_code
+        await send({"type": "http.response.start", "status": status_code, "headers": self.raw_headers})
+
+    async def _send_file(self, scope: Scope, send: Send, fd: int, offset: int, count: int, more_body: bool) -> None:
+        if ZEROCOPY in scope.get("extensions", {}):
+            await send({"type": ZEROCOPY, "file": fd, "offset": offset, "count": count, "more_body": more_body})
+            return
+        end = offset + count
+        while offset < end:
+            chunk = await run_in_threadpool(os.pread, fd, min(self.chunk_size, end - offset), offset)
+            if not chunk:
+                # file shrank under us, still end the response
+                await send({"type": "http.response.body", "body": b"", "more_body": more_body})
+                break
+            offset += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body or offset < end})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            stat_result = await run_in_threadpool(os.stat, self.path)
+        except FileNotFoundError:
+            response = Response("Not Found", status_code=404)
+            await response(scope, receive, send)
+            return
+        size = stat_result.st_size
+        self._validators(stat_result)
+
+        ranges = None
+        if self._if_range_matches(stat_result):
+            try:
+                ranges = parse_range(self.request_headers.get("range"), size)
+            except RangeNotSatisfiable:
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                await self._start(send, 416)
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if self.accel_redirect is not None:
+            # nginx repeats the Range/If-Range handling itself on the internal location
+            del self.headers["content-type"]
+            self.headers["x-accel-redirect"] = self.accel_redirect
+            self.headers["content-length"] = "0"
+            await self._start(send, 200)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if ranges is None:
+            parts, status_code = [(0, size - 1, b"")], 200
+            self.headers["content-length"] = str(size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            parts, status_code = [(start, end, b"")], 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+        else:
+            boundary = secrets.token_hex(16)
+            parts, status_code = [
+                (start, end, (f"--{boundary}\r\nContent-Type: {self.media_type}\r\n"
+                              f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode())
+                for start, end in ranges
+            ], 206
+            closing = f"\r\n--{boundary}--\r\n".encode()
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            self.headers["content-length"] = str(
+                sum(len(head) + end - start + 1 + 2 for start, end, head in parts) - 2 + len(closing))
+
+        await self._start(send, status_code)
+        if self.send_header_only or size == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        fd = await run_in_threadpool(os.open, self.path, os.O_RDONLY)
+        try:
+            for index, (start, end, head) in enumerate(parts):
+                if index:
+                    head = b"\r\n" + head
+                if head:
+                    await send({"type": "http.response.body", "body": head, "more_body": True})
+                await self._send_file(scope, send, fd, start, end - start + 1, more_body=bool(len(parts) > 1))
+            if len(parts) > 1:
+                await send({"type": "http.response.body", "body": closing})
+        finally:
+            os.close(fd)
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+from fastapi import Request, Response, status
+from fastapi.exceptions import HTTPException
+from fastapi_jwt_auth.exceptions import AuthJWTException
+from starlette.requests import HTTPConnection
+from decouple import config, Csv
+from settings import LOGGER
+from db.database import async_redis_conn
+from db.auth_config.token_cache import CachedAuthJWT
+import ipaddress
+import math
+import time
+
+RATE_LIMIT_PREFIX = "rl:"
+RATE_LIMIT_LOCAL_SIZE = config('RATE_LIMIT_LOCAL_SIZE', default=10_000, cast=int)
+RATE_LIMIT_FAIL_OPEN = config('RATE_LIMIT_FAIL_OPEN', default=True, cast=bool)
+# addresses or networks of reverse proxies (nginx) whose X-Forwarded-For is believed
+RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(network, strict=False)
+    for network in config('RATE_LIMIT_TRUSTED_PROXIES', default='127.0.0.1,::1', cast=Csv())
+]
+
+# GCRA: the key holds the theoretical arrival time (TAT) in ms.
+# ARGV: now, emission interval (period / limit), tolerance (period), cost
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local emission = tonumber(ARGV[2])
+local tolerance = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + emission * tonumber(ARGV[4])
+local allow_at = new_tat - tolerance
+if now < allow_at then
+    return {0, math.ceil(allow_at - now), 0}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {1, 0, math.floor((now + tolerance - new_tat) / emission)}
+"""
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def client_ip(connection: HTTPConnection) -> str:
+    """address of the client, looking through trusted proxies
+
+    X-Forwarded-For is read right to left, every hop appended by a trusted
+    proxy is skipped and the first other address is the client. Anything
+    further left was sent by the client itself and is ignored, so the header
+    cannot be used to pick someone else's budget.
+    """
+    host = connection.client.host if connection.client else "unknown"
+    if not _trusted(host):
+        return host
+    forwarded = ",".join(connection.headers.getlist("x-forwarded-for"))
+    for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+        host = hop
+        if not _trusted(hop):
+            break
+    return host
+
+
+class LocalBuckets:
+    """per worker token buckets in front of Redis
+
+    A worker only sees part of the traffic, so a client that empties the
+    local bucket (same rate and burst as the global limit) is over the limit
+    for sure and is refused without asking Redis. Keys refused by Redis are
+    remembered until their retry time.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    def take(self, key: str, limit: int, period: float) -> Optional[float]:
+        """None when the request may go on to Redis, otherwise seconds to wait"""
+        now = time.monotonic()
+        tokens, updated, blocked_until = self._buckets.get(key, (limit, now, 0.0))
+        if blocked_until > now:
+            return blocked_until - now
+        tokens = min(limit, tokens + (now - updated) * limit / period)
+        if tokens < 1:
+            self._store(key, (tokens, now, 0.0))
+            return (1 - tokens) * period / limit
+        self._store(key, (tokens - 1, now, 0.0))
+        return None
+
+    def block(self, key: str, seconds: float) -> None:
+        tokens, updated, _ = self._buckets.get(key, (0, time.monotonic(), 0.0))
+        self._store(key, (tokens, updated, time.monotonic() + seconds))
+
+    def _store(self, key: str, state: tuple) -> None:
+        self._buckets[key] = state
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+
+
+class RateLimiter:
+    """one GCRA check per request, a single EVALSHA round trip"""
+
+    def __init__(self, redis, local_size: int, fail_open: bool) -> None:
+        self.redis = redis
+        self.fail_open = fail_open
+        self.local = LocalBuckets(local_size)
+        self.local_rejects = 0
+        self.redis_rejects = 0
+        self._script = None
+
+    async def hit(self, key: str, limit: int, period: float, cost: int = 1) -> Tuple[bool, float, int]:
+        """
+        Returns:
+            tuple: (allowed, seconds until the next request is allowed, remaining requests)
+        """
+        wait = self.local.take(key, limit, period)
+        if wait is not None:
+            self.local_rejects += 1
+            return False, wait, 0
+        if self._script is None:
+            self._script = self.redis.register_script(GCRA_SCRIPT)
+        period_ms = period * 1000
+        try:
+            allowed, retry_after, remaining = await self._script(
+                keys=[RATE_LIMIT_PREFIX + key],
+                args=[int(time.time() * 1000), period_ms / limit, period_ms, cost])
+        except Exception as e:
+            LOGGER.error(f'rate limiter unavailable: {e}')
+            return self.fail_open, 1.0, 0
+        if not allowed:
+            self.redis_rejects += 1
+            self.local.block(key, retry_after / 1000)
+            return False, retry_after / 1000, 0
+        return True, 0.0, int(remaining)
+
+    def stats(self) -> dict:
+        return {"local_rejects": self.local_rejects, "redis_rejects": self.redis_rejects}
+
+
+rate_limiter = RateLimiter(async_redis_conn, RATE_LIMIT_LOCAL_SIZE, RATE_LIMIT_FAIL_OPEN)
+
+
+class RateLimit:
+    """``times`` requests per period, declared per route
+
+    Usable as a route dependency (``Depends(RateLimit(times=2, minutes=3))``)
+    and, through ``allow``, for websocket messages.
+
+    Args:
+        per: "ip" (default), "user" (JWT subject, falls back to the ip for
+            anonymous requests) or "route" (one budget shared by all clients)
+        name: budget name, defaults to the endpoint; routes with the same
+            name share a budget
+    """
+
+    def __init__(self, times: int, seconds: int = 0, minutes: int = 0, hours: int = 0,
+                 per: str = "ip", name: str = None) -> None:
+        if per not in ("ip", "user", "route"):
+            raise ValueError(f"unknown rate limit scope {per}")
+        self.times = times
+        self.period = seconds + 60 * minutes + 3600 * hours
+        self.per = per
+        self.name = name
+
+    def _identity(self, connection: HTTPConnection) -> str:
+        if self.per == "route":
+            return "all"
+        if self.per == "user" and isinstance(connection, Request):
+            try:
+                # signature only: the budget key needs no denylist check, that would block on redis
+                subject = CachedAuthJWT(req=connection).get_jwt_subject()
+            except AuthJWTException:
+                subject = None
+            if subject is not None:
+                return f"user:{subject}"
+        return f"ip:{client_ip(connection)}"
+
+    def key(self, connection: HTTPConnection) -> str:
+        name = self.name
+        if name is None:
+            endpoint = connection.scope.get("endpoint")
+            name = f"{endpoint.__module__}.{endpoint.__qualname__}" if endpoint else connection.scope["path"]
+        return f"{name}:{self._identity(connection)}"
+
+    async def allow(self, connection: HTTPConnection) -> Tuple[bool, float, int]:
+        return await rate_limiter.hit(self.key(connection), self.times, self.period)
+
+    async def __call__(self, request: Request, response: Response) -> None:
+        allowed, retry_after, remaining = await self.allow(request)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too Many Requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+        response.headers["X-RateLimit-Limit"] = str(self.times)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
@@ -0,0 +1,89 @@
+"""cold start benchmark: import time per package and time to first request
+
+    python -m utils.startup_bench [--runs 3] [--path /] [--top 15]
+
+Run it from the project directory with the same .env as the workers; set
+FAST_STARTUP=True in the environment to measure the deferred startup.
+"""
+from collections import defaultdict
+from http.client import HTTPConnection
+from typing import Dict, Tuple
+import subprocess
+import argparse
+import socket
+import time
+import sys
+import os
+
+
+def import_times(module: str = "main") -> Tuple[float, Dict[str, float]]:
+    """``python -X importtime``: total seconds and self time per top level package"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, check=True)
+    packages = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1e6
+        if name.strip() == module:
+            total = int(cumulative_us) / 1e6
+    return total, packages
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def first_request(path: str, timeout: float = 60.0) -> float:
+    """seconds from spawning uvicorn until ``path`` is answered"""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {server.returncode}:\n{server.stderr.read()[-2000:]}")
+            connection = HTTPConnection("127.0.0.1", port, timeout=1)
+            try:
+                connection.request("GET", path)
+                connection.getresponse().read()
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+            finally:
+                connection.close()
+        raise TimeoutError(f"no answer on {path} after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+        server.stderr.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="measure API cold start")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    fast = os.environ.get("FAST_STARTUP", "")
+    print(f"FAST_STARTUP={fast or 'unset'}, best of {args.runs} runs")
+    runs = [import_times() for _ in range(args.runs)]
+    total, packages = min(runs, key=lambda run: run[0])
+    print(f"\nimport main: {total * 1000:.1f} ms")
+    for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28} {seconds * 1000:8.1f} ms")
+    timings = [first_request(args.path) for _ in range(args.runs)]
+    print(f"\ntime to first request (GET {args.path}): "
+          f"best {min(timings) * 1000:.0f} ms, worst {max(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
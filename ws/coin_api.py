@@ -1,4 +1,3 @@
-import requests
 from decouple import config as env
 
 COIN_URL = env("COIN_API")
@@ -7,6 +6,8 @@ TIME_FRAME_LIST= [5,15,30,60,120,240,360,720,1440,10080]
 
 
 def coinAPI(url, password, time_frame, exchange):
+    import requests
+
     params = {
         "password": password,
         "time_frame": time_frame,
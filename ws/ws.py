@@ -8,6 +8,7 @@ from fastapi import (
 import asyncio
 from fastapi_jwt_auth import AuthJWT
 from starlette import websockets
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import RedirectResponse
 from starlette.websockets import WebSocketClose, WebSocketDisconnect
 from starlette import websockets
@@ -19,11 +20,14 @@ from .coin_api import (
     TIME_FRAME_LIST
 )
 from utils import CBV
+from utils.rate_limit import RateLimit
 
 ws = APIRouter(
     tags=['Websocket']
 )
 wrapper = CBV(ws)
+# per connection ip, checked for every received message
+MESSAGE_LIMIT = RateLimit(times=30, minutes=1, name="ws:messages")
 
 
 @ws.websocket("/ws")
@@ -42,7 +46,8 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Header(...) ,Aut
     """
     await websocket.accept()
     try:
-        Authorize.jwt_required("websocket", token=token)
+        # the denylist check may ask redis synchronously, keep it off the event loop
+        await run_in_threadpool(Authorize.jwt_required, "websocket", token=token)
     except AuthJWTException as err:
         await websocket.send_json({
             'status': 'fail',
@@ -53,6 +58,14 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Header(...) ,Aut
         await websocket.close()
     while websocket.application_state == websockets.WebSocketState.CONNECTED:
         message = await websocket.receive_json()
+        allowed, retry_after, _ = await MESSAGE_LIMIT.allow(websocket)
+        if not allowed:
+            await websocket.send_json({
+                'status': 'fail',
+                'message': 'rate limit exceeded',
+                'retry_after': retry_after
+            })
+            continue
         if message['start']:
             if message['time_frame'] in TIME_FRAME_LIST:
                 try: